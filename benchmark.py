@@ -0,0 +1,545 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import http.server
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import main
+import probe_engine
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+TCP_BEHAVIOURS = ["open", "open", "open", "open", "open", "open", "silent", "silent", "reset", "blackhole"]
+
+def legacy_is_valid_bridge_line(line):
+    if "No bridges available" in line:
+        return False
+    if line.startswith("#"):
+        return False
+    if len(line) < 10:
+        return False
+    return bool(re.search(r'\d+\.\d+\.\d+\.\d+|\[.*\]|https?://', line))
+
+def legacy_extract_connection_info(line):
+    line = line.strip()
+    if not line or len(line) < 5:
+        return None, None, None
+    line_lower = line.lower()
+    if "obfs4" in line_lower:
+        transport = "obfs4"
+    elif "webtunnel" in line_lower or "https://" in line_lower:
+        transport = "webtunnel"
+    else:
+        transport = "vanilla"
+    patterns = [
+        (r'https?://\[([0-9a-fA-F:]+)\](?::(\d+))?', "ipv6"),
+        (r'https?://([^/:]+)(?::(\d+))?', "domain"),
+        (r'\[([0-9a-fA-F:]+)\]:(\d+)', "ipv6"),
+        (r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}):(\d+)', "ipv4"),
+        (r'([a-zA-Z0-9.-]+):(\d+)', "domain"),
+        (r'obfs4\s+([^:]+):(\d+)\s+', "obfs4"),
+        (r'(\S+)\s+(\S+)\s+(\S+)', "fingerprint"),
+    ]
+    for pattern, ptype in patterns:
+        match = re.search(pattern, line, re.IGNORECASE)
+        if match:
+            if ptype == "fingerprint" and len(match.groups()) >= 3:
+                return match.group(1), int(match.group(2)), transport
+            elif len(match.groups()) >= 2:
+                return match.group(1), int(match.group(2) if match.group(2) else "443"), transport
+    return None, None, transport
+
+def legacy_pipeline(lines):
+    for line in lines:
+        if legacy_is_valid_bridge_line(line):
+            re.sub(r'\s+', ' ', line.strip()).lower()
+            legacy_extract_connection_info(line)
+
+def parser_pipeline(lines):
+    for line in lines:
+        main.parse_bridge_line(line)
+
+def load_corpus():
+    lines = []
+    for path in sorted(glob.glob(os.path.join(main.BRIDGE_DIR, "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            lines.extend(line.strip() for line in f if line.strip())
+    return lines
+
+def timed(func, lines, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(lines)
+    return (time.perf_counter() - start) / rounds
+
+def bench_parser(rounds=50):
+    lines = load_corpus()
+    legacy = timed(legacy_pipeline, lines, rounds)
+    main.parse_bridge_line.cache_clear()
+    cold = timed(lambda l: (main.parse_bridge_line.cache_clear(), parser_pipeline(l)), lines, rounds)
+    warm = timed(parser_pipeline, lines, rounds)
+    print(f"parser: {len(lines)} lines")
+    print(f"  legacy regex chain : {legacy * 1000:8.2f} ms")
+    print(f"  single-pass (cold) : {cold * 1000:8.2f} ms  ({legacy / cold:.1f}x)")
+    print(f"  single-pass (warm) : {warm * 1000:8.2f} ms  ({legacy / warm:.1f}x)")
+
+def legacy_extract(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    bridge_div = soup.find("div", id="bridgelines")
+    return [line.strip() for line in bridge_div.get_text().split("\n") if line.strip()]
+
+def streaming_extract(html, chunk_size=8192):
+    return list(main.iter_bridge_lines(html[i:i + chunk_size] for i in range(0, len(html), chunk_size)))
+
+def measure(func, arg, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    elapsed = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def import_time(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - start
+
+def bench_extractor(rounds=50):
+    fixtures = sorted(glob.glob(os.path.join(FIXTURE_DIR, "bridges_*.html")))
+    print(f"extractor: {len(fixtures)} fixtures")
+    for path in fixtures:
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+        if '<div class="bridge-lines" id="bridgelines">' not in html:
+            continue
+        legacy_time, legacy_peak = measure(legacy_extract, html, rounds)
+        stream_time, stream_peak = measure(streaming_extract, html, rounds)
+        print(f"  {os.path.basename(path):28} bs4 {legacy_time * 1000:6.2f} ms {legacy_peak / 1024:7.1f} KiB | "
+              f"streaming {stream_time * 1000:6.2f} ms {stream_peak / 1024:7.1f} KiB")
+    baseline = import_time("json")
+    print(f"  import bs4 overhead: {(import_time('bs4') - baseline) * 1000:.0f} ms")
+
+def bench_startup(rounds=5):
+    baseline = min(import_time("json") for _ in range(rounds))
+    startup = min(import_time("main") for _ in range(rounds))
+    print(f"startup: import main overhead {(startup - baseline) * 1000:.0f} ms")
+
+class ListenerProtocol(asyncio.Protocol):
+    def __init__(self, behaviour, tls_context, tls_delay):
+        self.behaviour = behaviour
+        self.tls_context = tls_context
+        self.tls_delay = tls_delay
+
+    def connection_made(self, transport):
+        self.transport = transport
+        loop = asyncio.get_running_loop()
+        if self.behaviour == "reset":
+            transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            transport.abort()
+        elif self.behaviour == "tls":
+            asyncio.ensure_future(self.upgrade())
+        elif self.behaviour == "open":
+            loop.call_later(1, transport.close)
+
+    async def upgrade(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self.tls_delay)
+        try:
+            tls_transport = await loop.start_tls(self.transport, self, self.tls_context, server_side=True)
+        except Exception:
+            self.transport.close()
+            return
+        loop.call_later(1, tls_transport.close)
+
+def open_blackhole():
+    sock = socket.socket()
+    sock.bind(("0.0.0.0", 0))
+    sock.listen(0)
+    fillers = []
+    for _ in range(3):
+        filler = socket.socket()
+        filler.setblocking(False)
+        try:
+            filler.connect(("127.0.0.1", sock.getsockname()[1]))
+        except BlockingIOError:
+            pass
+        fillers.append(filler)
+    return sock, fillers
+
+def serve_listeners(ports_per_behaviour, tls_delay, ready):
+    async def run():
+        loop = asyncio.get_running_loop()
+        tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        tls_context.load_cert_chain(os.path.join(FIXTURE_DIR, "bench_cert.pem"), os.path.join(FIXTURE_DIR, "bench_key.pem"))
+        ports = {}
+        keep = []
+        for behaviour in ["open", "silent", "reset", "tls", "blackhole"]:
+            ports[behaviour] = []
+            for _ in range(ports_per_behaviour):
+                if behaviour == "blackhole":
+                    sock, fillers = open_blackhole()
+                    keep.append((sock, fillers))
+                    ports[behaviour].append(sock.getsockname()[1])
+                    continue
+                server = await loop.create_server(
+                    lambda behaviour=behaviour: ListenerProtocol(behaviour, tls_context, tls_delay),
+                    "0.0.0.0", 0, backlog=1024,
+                )
+                keep.append(server)
+                ports[behaviour].append(server.sockets[0].getsockname()[1])
+        ready.put(ports)
+        await asyncio.Event().wait()
+    asyncio.run(run())
+
+def bridge_page(lines):
+    with open(os.path.join(FIXTURE_DIR, "bridges_obfs4.html"), "r", encoding="utf-8") as f:
+        template = f.read()
+    start = template.index('<div class="bridge-lines" id="bridgelines">') + len('<div class="bridge-lines" id="bridgelines">')
+    end = template.index("</div>", start)
+    return template[:start] + "\n" + "".join(f"{line}<br />\n" for line in lines) + template[end:]
+
+ROTATION_PERIODS = {"obfs4": 600, "webtunnel": 3600, "vanilla": 4 * 3600}
+
+def rotating_page(transport, now):
+    page = now // ROTATION_PERIODS[transport]
+    lines = []
+    for k in range(3):
+        fingerprint = hashlib.sha1(f"{transport}-{page}-{k}".encode("ascii")).hexdigest().upper()
+        lines.append(f"obfs4 192.0.2.{k + 1}:443 {fingerprint} cert=bench iat-mode=0")
+    return f'"{transport}-{page}"', bridge_page(lines)
+
+def serve_bridge_site(pages, ready):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            query = self.path.partition("?")[2]
+            params = dict(param.partition("=")[::2] for param in query.split("&"))
+            transport = params.get("transport", "obfs4")
+            if self.path.startswith("/rotating"):
+                etag, body = rotating_page(transport, int(params.get("t", 0)))
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            else:
+                etag, body = None, pages.get(transport, pages["obfs4"])
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+def loopback_host(i):
+    # Every bridge gets its own 127/8 address so no two share an endpoint
+    i += 1
+    return f"127.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+def synthetic_lines(size, ports, start=0):
+    seeds = sorted(main.parse_bridge_lines(load_corpus()))
+    for i in range(start, start + size):
+        seed = seeds[i % len(seeds)]
+        fingerprint = f"{i:040X}"
+        if seed.transport == "webtunnel":
+            port = ports["tls"][i % len(ports["tls"])]
+            yield f"webtunnel [2001:db8::{i % 65536:x}]:443 {fingerprint} url=https://wt{i:x}.bench.test:{port}/{i:x} ver=0.0.3"
+            continue
+        behaviour = TCP_BEHAVIOURS[i % len(TCP_BEHAVIOURS)]
+        port = ports[behaviour][(i // len(TCP_BEHAVIOURS)) % len(ports[behaviour])]
+        if seed.transport == "obfs4":
+            yield f"obfs4 {loopback_host(i)}:{port} {fingerprint} cert={seed.cert} iat-mode={seed.iat_mode}"
+        else:
+            yield f"{loopback_host(i)}:{port} {fingerprint}"
+
+def synthetic_corpus(size, ports):
+    return list(synthetic_lines(size, ports))
+
+def latency_summary(samples):
+    values = sorted(samples)
+    return {
+        "p50_ms": round(main.percentile(values, 0.5) * 1000, 4) if values else None,
+        "p99_ms": round(main.percentile(values, 0.99) * 1000, 4) if values else None,
+    }
+
+def thread_count():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+def stage_parse(size, ports, config):
+    lines = synthetic_corpus(size, ports)
+    main.parse_bridge_line.cache_clear()
+    samples = []
+    start = time.perf_counter()
+    for line in lines:
+        line_start = time.perf_counter()
+        main.extract_connection_info(line)
+        samples.append(time.perf_counter() - line_start)
+    elapsed = time.perf_counter() - start
+    return {"items": len(lines), "seconds": elapsed, "throughput_per_s": len(lines) / elapsed, **latency_summary(samples)}
+
+def stage_probe(size, ports, config):
+    probe_engine.CONNECTION_TIMEOUT = config["connect_timeout"]
+    probe_engine.PROBE_DEADLINE = config["connect_timeout"] * probe_engine.MAX_RETRIES + 1
+    main.MAX_TEST_PER_TYPE = size
+    probe_engine.set_static_resolver({f"wt{i:x}.bench.test": [loopback_host(i)] for i in range(size)})
+    bridges = list(main.parse_bridge_lines(synthetic_corpus(size, ports)))
+    samples = []
+    timed_test = probe_engine.advanced_connection_test
+
+    async def measured_test(bridge, family="IPv4", errors=None):
+        probe_start = time.perf_counter()
+        try:
+            return await timed_test(bridge, family, errors)
+        finally:
+            samples.append(time.perf_counter() - probe_start)
+
+    probe_engine.advanced_connection_test = measured_test
+    start = time.perf_counter()
+    working = probe_engine.batch_test_bridges(bridges, "bench", batch_size=max(1000, size))
+    elapsed = time.perf_counter() - start
+    return {
+        "items": len(bridges),
+        "endpoints": len(samples),
+        "working": len(working),
+        "seconds": elapsed,
+        "throughput_per_s": len(samples) / elapsed,
+        **latency_summary(samples),
+    }
+
+def stage_fetch(size, ports, config):
+    fetcher = main.Fetcher(state={}, rate=1e9)
+    target = {"url": f"http://127.0.0.1:{config['site_port']}/bridges?transport=obfs4", "file": "bench.txt"}
+    samples = []
+    lines = 0
+    start = time.perf_counter()
+    for _ in range(size):
+        fetch_start = time.perf_counter()
+        lines += len(fetcher.fetch(target))
+        samples.append(time.perf_counter() - fetch_start)
+    elapsed = time.perf_counter() - start
+    return {"items": size, "lines": lines, "seconds": elapsed, "throughput_per_s": size / elapsed, **latency_summary(samples)}
+
+def stage_history(size, ports, config):
+    lines = synthetic_corpus(size, ports)
+    workdir = tempfile.mkdtemp(prefix="bridge-bench-")
+    results = {}
+    try:
+        for name, store_class, path in [
+            ("sqlite", main.SqliteHistoryStore, os.path.join(workdir, "history.db")),
+            ("json", main.JsonHistoryStore, os.path.join(workdir, "history.json")),
+        ]:
+            samples = []
+            start = time.perf_counter()
+            store = store_class(path)
+            now = int(time.time())
+            for op in [
+                lambda: store.record_seen(lines, now - 3600),
+                store.save,
+                lambda: store.record_seen(lines[: len(lines) // 10], now),
+                lambda: store.seen_since(now - 1800),
+                lambda: store.cleanup(now - 86400),
+                store.save,
+            ]:
+                op_start = time.perf_counter()
+                op()
+                samples.append(time.perf_counter() - op_start)
+            store.close()
+            elapsed = time.perf_counter() - start
+            results[name] = {"seconds": elapsed, "throughput_per_s": len(lines) / elapsed, **latency_summary(samples)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"items": len(lines), **results}
+
+def stage_archive(size, ports, config):
+    workdir = tempfile.mkdtemp(prefix="bridge-bench-")
+    path = os.path.join(workdir, "bench.txt")
+    samples = []
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in synthetic_lines(size, ports))
+        table = main.BridgeTable()
+        start = time.perf_counter()
+        archive = main.read_archive(path, table)
+        samples.append(time.perf_counter() - start)
+        op_start = time.perf_counter()
+        new_ids = archive.update(table.add(line) for line in synthetic_lines(size // 100, ports, size))
+        samples.append(time.perf_counter() - op_start)
+        now = int(time.time())
+        probe_stats = {table.endpoint(bridge_id): [0.5, 0, now - bridge_id % 86400] for bridge_id in range(0, len(table), 50)}
+        op_start = time.perf_counter()
+        candidates = main.select_candidates(archive, probe_stats)
+        samples.append(time.perf_counter() - op_start)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "items": len(archive),
+        "new": len(new_ids),
+        "candidates": len(candidates),
+        "read_s": samples[0],
+        "update_s": samples[1],
+        "select_s": samples[2],
+        "seconds": elapsed,
+        "throughput_per_s": len(archive) / elapsed,
+    }
+
+def simulate_discovery(fetcher, targets, hours, tick, adaptive):
+    seen = set()
+    fetched = 0
+    start = time.perf_counter()
+    for now in range(0, hours * 3600, tick):
+        for target in targets:
+            if adaptive and not fetcher.due(target, now):
+                continue
+            lines = fetcher.fetch(dict(target, url=f"{target['url']}&t={now}"))
+            fetched += 1
+            new_lines = set(lines or ()) - seen
+            seen.update(new_lines)
+            fetcher.record(target, len(new_lines), now)
+    return {"requests": fetched, "bridges": len(seen), "bridges_per_request": round(len(seen) / fetched, 3), "seconds": time.perf_counter() - start}
+
+def stage_discovery(size, ports, config):
+    base = f"http://127.0.0.1:{config['site_port']}/rotating"
+    targets = [{"url": f"{base}?transport={transport}", "file": f"{transport}.txt"} for transport in ROTATION_PERIODS]
+    results = {}
+    for name, adaptive, tick in [("uniform", False, main.FETCH_BASE_INTERVAL), ("adaptive", True, int(main.FETCH_BASE_INTERVAL * main.FETCH_INTERVAL_MIN / 3))]:
+        fetcher = main.Fetcher(slack=0, state={}, targets=targets, rate=1e9)
+        results[name] = simulate_discovery(fetcher, targets, size, tick, adaptive)
+        fetcher.close()
+    return {"items": size, "seconds": sum(result["seconds"] for result in results.values()), **results}
+
+STAGES = {"parse": stage_parse, "probe": stage_probe, "fetch": stage_fetch, "history": stage_history, "discovery": stage_discovery, "archive": stage_archive}
+
+def measure_stage(stage, size, ports, config):
+    peak_threads = [thread_count()]
+    stop = threading.Event()
+
+    def sample_threads():
+        while not stop.wait(0.05):
+            peak_threads.append(thread_count() - 1)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    result = STAGES[stage](size, ports, config)
+    stop.set()
+    sampler.join()
+    result.update({
+        "stage": stage,
+        "size": size,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "max_threads": max(peak_threads),
+    })
+    return result
+
+def run_suite(stages, sizes, output, ports_per_behaviour, tls_delay, connect_timeout, fetches, hours, archive_lines):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    listeners = context.Process(target=serve_listeners, args=(ports_per_behaviour, tls_delay, ready), daemon=True)
+    listeners.start()
+    ports = ready.get(timeout=30)
+    pages = {transport: bridge_page(synthetic_corpus(3, ports)) for transport in ["obfs4", "webtunnel", "vanilla"]}
+    site = context.Process(target=serve_bridge_site, args=(pages, ready), daemon=True)
+    site.start()
+    config = {
+        "connect_timeout": connect_timeout,
+        "site_port": ready.get(timeout=30),
+        "ports_per_behaviour": ports_per_behaviour,
+        "tls_delay": tls_delay,
+        "probe_mode": probe_engine.PROBE_MODE,
+    }
+    results = []
+    try:
+        for stage in stages:
+            for size in ([fetches] if stage == "fetch" else [hours] if stage == "discovery" else [archive_lines] if stage == "archive" else sizes):
+                with context.Pool(1) as pool:
+                    result = pool.apply(measure_stage, (stage, size, ports, config))
+                results.append(result)
+                print(f"{stage:8} {size:>7}: {result['seconds']:.3f} s, rss {result['peak_rss_kb'] / 1024:.1f} MiB, threads {result['max_threads']}" if "seconds" in result
+                      else f"{stage:8} {size:>7}: rss {result['peak_rss_kb'] / 1024:.1f} MiB, threads {result['max_threads']}")
+                if stage == "discovery":
+                    print("".join(f"{'':8} {name:>8}: {result[name]['bridges']} bridges from {result[name]['requests']} requests\n" for name in ("uniform", "adaptive")), end="")
+    finally:
+        listeners.terminate()
+        site.terminate()
+    report = {
+        "generated_at": int(time.time()),
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in config.items() if key != "site_port"},
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the bridge collector.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("compare", help="compare the parser and extractor with the previous implementations")
+    suite = subparsers.add_parser("suite", help="run the offline suite against local stand-in bridges")
+    suite.add_argument("--stages", default="parse,probe,fetch,history,discovery,archive")
+    suite.add_argument("--sizes", default="1000,10000,100000")
+    suite.add_argument("--output", default="bench_results.json")
+    suite.add_argument("--ports-per-behaviour", type=int, default=64)
+    suite.add_argument("--tls-delay", type=float, default=0.05)
+    suite.add_argument("--connect-timeout", type=float, default=1.0)
+    suite.add_argument("--fetches", type=int, default=200)
+    suite.add_argument("--hours", type=int, default=168, help="simulated hours for the discovery stage")
+    suite.add_argument("--archive-lines", type=int, default=1000000, help="archive size for the archive stage")
+    args = parser.parse_args()
+    if args.command == "suite":
+        run_suite(
+            [stage for stage in args.stages.split(",") if stage],
+            [int(size) for size in args.sizes.split(",") if size],
+            args.output,
+            args.ports_per_behaviour,
+            args.tls_delay,
+            args.connect_timeout,
+            args.fetches,
+            args.hours,
+            args.archive_lines,
+        )
+    else:
+        bench_parser()
+        bench_extractor()
+        bench_startup()
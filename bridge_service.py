@@ -0,0 +1,207 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from main import (
+    BRIDGE_DIR, HISTORY_DB, HISTORY_FILE, PROBE_CACHE_FILE, SERVE_HOST, SERVE_PORT, SERVE_RELOAD_INTERVAL, TARGETS,
+    BridgeTable, decode_probe_results, load_history, log, output_filenames, read_archive,
+)
+
+def parse_duration(value):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value and value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+class BridgeIndex:
+    ORDERS = ("line", "rtt", "first_seen")
+    TRANSPORTS = tuple(sorted({target["type"].lower() for target in TARGETS}))
+    FAMILIES = {"4": "IPv4", "6": "IPv6"}
+
+    def __init__(self, table, entries, signature=None):
+        self.table = table
+        self.signature = signature
+        self.loaded_at = int(time.time())
+        buckets = {}
+        for transport, family, bridge_id, tested, rtt in entries:
+            for key_transport in (transport, None):
+                for key_family in (family, None):
+                    for key_tested in ((False, True) if tested else (False,)):
+                        bucket = buckets.setdefault((key_transport, key_family, key_tested), {})
+                        if bridge_id not in bucket or (rtt is not None and (bucket[bridge_id] is None or rtt < bucket[bridge_id])):
+                            bucket[bridge_id] = rtt
+        self.size = len(buckets.get((None, None, False), ()))
+        lines = table.lines
+        first_seen = table.first_seen
+        self.lists = {}
+        for key, bucket in buckets.items():
+            ids = sorted(bucket, key=lines.__getitem__)
+            self.lists[key] = {
+                "line": array("l", ids),
+                "rtt": array("l", sorted(ids, key=lambda bridge_id: (bucket[bridge_id] is None, bucket[bridge_id] or 0))),
+                "first_seen": array("l", sorted(ids, key=lambda bridge_id: -first_seen[bridge_id])),
+            }
+        self.render = lru_cache(maxsize=1024)(self.render_lines)
+        for transport, family, tested in self.lists:
+            self.render(transport, family, tested, None, "line", None)
+
+    @classmethod
+    def load(cls, signature=None):
+        table = BridgeTable()
+        archives = {}
+        for target in TARGETS:
+            names = output_filenames(target["file"])
+            archives[target["file"]] = (read_archive(names["archive"], table), read_archive(names["tested"], table))
+        history = load_history(read_only=True)
+        try:
+            table.load_first_seen(history.iter_first_seen())
+        finally:
+            history.close()
+        cache = {}
+        if os.path.exists(PROBE_CACHE_FILE):
+            try:
+                with open(PROBE_CACHE_FILE, "r", encoding="utf-8") as f:
+                    cache = decode_probe_results(json.load(f))
+            except Exception as e:
+                log(f"Error loading probe cache: {e}")
+
+        def entries():
+            for target in TARGETS:
+                archive, tested = archives[target["file"]]
+                for bridge_id in archive:
+                    endpoint = table.endpoint(bridge_id, target["ip"])
+                    entry = cache.get(endpoint)
+                    yield target["type"].lower(), endpoint[3], bridge_id, bridge_id in tested, entry[1].connect_ms if entry and entry[1] else None
+
+        return cls(table, entries(), signature)
+
+    def select(self, transport, family, tested, since, order, limit):
+        ids = self.lists.get((transport, family, tested), {}).get(order, ())
+        if since is not None:
+            cutoff = int(time.time()) // 60 * 60 - since
+            first_seen = self.table.first_seen
+            if order == "first_seen":
+                ids = ids[:bisect.bisect_right(ids, -cutoff, key=lambda bridge_id: -first_seen[bridge_id])]
+            else:
+                ids = [bridge_id for bridge_id in ids if first_seen[bridge_id] >= cutoff]
+        return ids[:limit] if limit is not None else ids
+
+    def render_lines(self, transport, family, tested, since, order, limit, minute=None):
+        lines = self.table.lines
+        body = "".join(lines[bridge_id] + "\n" for bridge_id in self.select(transport, family, tested, since, order, limit)).encode("utf-8")
+        return body, gzip.compress(body, mtime=0), '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def query(self, params):
+        def single(name, default=None):
+            values = params.get(name)
+            return values[-1] if values else default
+
+        transport = single("transport")
+        if transport is not None and transport.lower() not in self.TRANSPORTS:
+            raise ValueError(f"unknown transport {transport!r}")
+        family = single("ip")
+        if family is not None and family not in self.FAMILIES:
+            raise ValueError("ip must be 4 or 6")
+        tested = single("tested", "0")
+        if tested not in ("0", "1"):
+            raise ValueError("tested must be 0 or 1")
+        order = single("order", "line")
+        if order not in self.ORDERS:
+            raise ValueError(f"order must be one of {', '.join(self.ORDERS)}")
+        since = single("since")
+        limit = single("limit")
+        since = parse_duration(since) if since is not None else None
+        limit = int(limit) if limit is not None else None
+        if (since is not None and since < 0) or (limit is not None and limit < 0):
+            raise ValueError("since and limit must not be negative")
+        return self.render(
+            transport.lower() if transport else None,
+            self.FAMILIES.get(family),
+            tested == "1",
+            since,
+            order,
+            limit,
+            int(time.time()) // 60 if since is not None else None,
+        )
+
+def output_signature():
+    paths = [os.path.join(BRIDGE_DIR, name) for name in os.listdir(BRIDGE_DIR) if name.endswith(".txt")] if os.path.isdir(BRIDGE_DIR) else []
+    paths += [PROBE_CACHE_FILE, HISTORY_DB, HISTORY_FILE]
+    signature = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+class BridgeQueryHandler(BaseHTTPRequestHandler):
+    server_version = "TorBridgesCollector"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = self.server.index
+        if url.path == "/health":
+            body = json.dumps({"bridges": index.size, "loaded_at": index.loaded_at}).encode("utf-8")
+            return self.respond(200, body, "application/json")
+        if url.path != "/bridges":
+            return self.respond(404, b"not found\n")
+        try:
+            body, gzipped, etag = index.query(parse_qs(url.query))
+        except ValueError as e:
+            return self.respond(400, f"{e}\n".encode("utf-8"))
+        if etag in {tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")}:
+            return self.respond(304, b"", headers={"ETag": etag})
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = gzipped
+        self.respond(200, body, headers=headers)
+
+    def respond(self, status, body, content_type="text/plain; charset=utf-8", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def watch_outputs(server, interval):
+    while True:
+        time.sleep(interval)
+        signature = output_signature()
+        if signature == server.index.signature:
+            continue
+        try:
+            server.index = BridgeIndex.load(signature)
+            log(f"Reloaded bridge index: {server.index.size} bridges.")
+        except Exception as e:
+            log(f"Error reloading bridge index: {e}")
+
+def serve(host=SERVE_HOST, port=SERVE_PORT):
+    server = ThreadingHTTPServer((host, port), BridgeQueryHandler)
+    server.daemon_threads = True
+    server.index = BridgeIndex.load(output_signature())
+    threading.Thread(target=watch_outputs, args=(server, SERVE_RELOAD_INTERVAL), daemon=True).start()
+    log(f"Serving {server.index.size} bridges on http://{host}:{server.server_address[1]}/bridges")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,16 +1,28 @@
 import os
-import requests
 import json
 import re
 import socket
-import concurrent.futures
-import ssl
+import tempfile
+import threading
+import heapq
+import random
+import hashlib
+import argparse
+import codecs
+import struct
+import sys
 import time
-import ipaddress
-import zipfile
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+import math
+import zlib
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from functools import lru_cache
+
+# The stage modules import this one by name; make that work when it runs as a script
+sys.modules.setdefault("main", sys.modules[__name__])
 
 TARGETS = [
     {"url": "https://bridges.torproject.org/bridges?transport=obfs4", "file": "obfs4.txt", "type": "obfs4", "ip": "IPv4"},
@@ -24,215 +36,822 @@ TARGETS = [
 RECENT_HOURS = 72
 HISTORY_RETENTION_DAYS = 30
 REPO_URL = "https://raw.githubusercontent.com/Delta-Kronecker/Tor-Bridges-Collector/refs/heads/main"
-MAX_WORKERS = 50
-CONNECTION_TIMEOUT = 8
-MAX_RETRIES = 2
-SSL_TIMEOUT = 5
+FASTEST_LIMIT = 50
 MAX_TEST_PER_TYPE = 500
+PROBE_SCORE_DECAY = 0.7
+PROBE_COVERAGE_HOURS = 24
+PROBE_BACKOFF_MAX_HOURS = 7 * PROBE_COVERAGE_HOURS
+PROBE_PROCESSES = int(os.getenv('PROBE_PROCESSES', 1))
 
 IS_GITHUB = os.getenv('GITHUB_ACTIONS') == 'true'
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 TELEGRAM_UPLOAD = os.getenv('TELEGRAM_UPLOAD', '').lower() == 'true'
+UPLOAD_RETRIES = 3
+UPLOAD_TIMEOUT = 60
+ZIP_WORKERS = 4
+METRICS_FILE = os.getenv('METRICS_FILE', 'run_metrics.json')
+PROMETHEUS_TEXTFILE = os.getenv('PROMETHEUS_TEXTFILE')
+PROFILE_RUN = os.getenv('PROFILE_RUN', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '.')
+FETCH_TIMEOUT = 30
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 2
+FETCH_BACKOFF_MAX = 60
+FETCH_RATE = float(os.getenv('FETCH_RATE', 1))
+FETCH_BURST = int(os.getenv('FETCH_BURST', len(TARGETS)))
+FETCH_BASE_INTERVAL = int(os.getenv('FETCH_BASE_INTERVAL', 3600))
+FETCH_INTERVAL_MIN = 0.25
+FETCH_INTERVAL_MAX = 6
+FETCH_SLACK = 0.15
+FETCH_YIELD_DECAY = 0.7
+FETCH_YIELD_SMOOTHING = 1
+DAEMON_FETCH_INTERVAL = int(os.getenv('DAEMON_FETCH_INTERVAL', 3600))
+DAEMON_PROBE_INTERVAL = int(os.getenv('DAEMON_PROBE_INTERVAL', 300))
+SERVE_HOST = os.getenv('SERVE_HOST', '127.0.0.1')
+SERVE_PORT = int(os.getenv('SERVE_PORT', 8080))
+SERVE_RELOAD_INTERVAL = 5
 
 BRIDGE_DIR = "bridge"
 HISTORY_FILE = os.path.join(BRIDGE_DIR, "bridge_history.json")
-
-if not os.path.exists(BRIDGE_DIR):
-    os.makedirs(BRIDGE_DIR)
+HISTORY_DB = os.path.join(BRIDGE_DIR, "bridge_history.db")
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'sqlite')
+HISTORY_LAST_SEEN_STEP = 24 * 3600
+PROBE_CACHE_FILE = os.path.join(BRIDGE_DIR, "probe_cache.json")
+PROBE_CACHE_TTL = int(os.getenv('PROBE_CACHE_TTL', 90 * 60))
+PROBE_STATS_FILE = os.path.join(BRIDGE_DIR, "probe_stats.json")
+SHARD_DIR = os.path.join(BRIDGE_DIR, "shards")
+ZIP_NAME = "tor_bridges.zip"
+UPLOAD_STATE_FILE = os.path.join(BRIDGE_DIR, "upload_state.json")
+FETCH_STATE_FILE = os.path.join(BRIDGE_DIR, "fetch_state.json")
 
 def log(message):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {message}")
 
-def is_valid_bridge_line(line):
-    if "No bridges available" in line:
-        return False
-    if line.startswith("#"):
-        return False
-    if len(line) < 10:
-        return False
-    return bool(re.search(r'\d+\.\d+\.\d+\.\d+|\[.*\]|https?://', line))
+class Metrics:
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+    SLOWEST_LIMIT = 10
 
-def extract_connection_info(line):
-    line = line.strip()
-    if not line or len(line) < 5:
-        return None, None, None
-    line_lower = line.lower()
-    if "obfs4" in line_lower:
-        transport = "obfs4"
-    elif "webtunnel" in line_lower or "https://" in line_lower:
-        transport = "webtunnel"
-    else:
-        transport = "vanilla"
-    patterns = [
-        (r'https?://\[([0-9a-fA-F:]+)\](?::(\d+))?', "ipv6"),
-        (r'https?://([^/:]+)(?::(\d+))?', "domain"),
-        (r'\[([0-9a-fA-F:]+)\]:(\d+)', "ipv6"),
-        (r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}):(\d+)', "ipv4"),
-        (r'([a-zA-Z0-9.-]+):(\d+)', "domain"),
-        (r'obfs4\s+([^:]+):(\d+)\s+', "obfs4"),
-        (r'(\S+)\s+(\S+)\s+(\S+)', "fingerprint"),
-    ]
-    for pattern, ptype in patterns:
-        match = re.search(pattern, line, re.IGNORECASE)
-        if match:
-            if ptype == "fingerprint" and len(match.groups()) >= 3:
-                host = match.group(1)
-                port = match.group(2)
-                return host, int(port), transport
-            elif len(match.groups()) >= 2:
-                host = match.group(1)
-                port = match.group(2) if match.group(2) else "443"
-                return host, int(port), transport
-            elif ptype in ["domain", "ipv6"]:
-                host = match.group(1)
-                port = "443" if "https" in line_lower else "80"
-                return host, int(port), transport
-    return None, None, transport
-
-def is_valid_ip(host):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counters = {}
+        self.histograms = {}
+        self.windows = {}
+        self.slowest = []
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {"buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0}
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def merge(self, counters, window=None):
+        for name, value in counters.items():
+            self.incr(name, value)
+        if window:
+            self.mark_window("probe", *window)
+
+    def add_duration(self, name, seconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name, histogram=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_duration(name, elapsed)
+            if histogram:
+                self.observe(histogram, elapsed)
+
+    def mark_window(self, name, start, end):
+        with self.lock:
+            first, last = self.windows.get(name, (start, end))
+            self.windows[name] = (min(first, start), max(last, end))
+
+    def record_slow(self, label, seconds):
+        with self.lock:
+            if len(self.slowest) < self.SLOWEST_LIMIT:
+                heapq.heappush(self.slowest, (seconds, label))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, label))
+
+    def snapshot(self, stats=None):
+        with self.lock:
+            probe_window = self.windows.get("probe")
+            probe_seconds = probe_window[1] - probe_window[0] if probe_window else 0.0
+            probes = self.counters.get("probes_total", 0)
+            return {
+                "started_at": int(self.started_at),
+                "run_seconds": round(time.perf_counter() - self.started, 3),
+                "stage_seconds": {name: round(value, 3) for name, value in sorted(self.durations.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "probes_per_second": round(probes / probe_seconds, 2) if probe_seconds else 0.0,
+                "histograms": {
+                    name: {"buckets": dict(zip([str(bound) for bound in self.BUCKETS], histogram["buckets"])), "count": histogram["count"], "sum": round(histogram["sum"], 3)}
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "slowest_endpoints": [{"endpoint": label, "seconds": round(seconds, 3)} for seconds, label in sorted(self.slowest, reverse=True)],
+                "stats": stats or {},
+            }
+
+    def to_prometheus(self, snapshot):
+        lines = ["# TYPE bridge_collector_stage_seconds gauge"]
+        for name, value in snapshot["stage_seconds"].items():
+            lines.append(f'bridge_collector_stage_seconds{{stage="{name}"}} {value}')
+        lines.append("# TYPE bridge_collector_events_total counter")
+        for name, value in snapshot["counters"].items():
+            lines.append(f'bridge_collector_events_total{{event="{name}"}} {value}')
+        lines.append("# TYPE bridge_collector_probes_per_second gauge")
+        lines.append(f"bridge_collector_probes_per_second {snapshot['probes_per_second']}")
+        lines.append("# TYPE bridge_collector_run_seconds gauge")
+        lines.append(f"bridge_collector_run_seconds {snapshot['run_seconds']}")
+        for name, histogram in snapshot["histograms"].items():
+            lines.append(f"# TYPE bridge_collector_{name} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'bridge_collector_{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'bridge_collector_{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f"bridge_collector_{name}_sum {histogram['sum']}")
+            lines.append(f"bridge_collector_{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def write_atomic(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
     try:
-        ipaddress.ip_address(host)
-        return True
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
     except:
-        return False
+        os.unlink(tmp_path)
+        raise
+
+class OutputWriter:
+    def __init__(self):
+        self.digests = {}
+        self.changed = set()
+
+    def reset(self):
+        self.changed = set()
+
+    def digest_on_disk(self, path):
+        if path not in self.digests:
+            try:
+                with open(path, "rb") as f:
+                    self.digests[path] = hashlib.sha256(f.read()).digest()
+            except OSError:
+                self.digests[path] = None
+        return self.digests[path]
+
+    def write(self, path, content):
+        digest = hashlib.sha256(content.encode("utf-8")).digest()
+        if self.digest_on_disk(path) == digest:
+            metrics.incr("outputs_unchanged")
+            return False
+        write_atomic(path, content)
+        self.digests[path] = digest
+        self.changed.add(path)
+        metrics.incr("outputs_written")
+        return True
 
-def resolve_host(host):
+outputs = OutputWriter()
+
+def write_metrics(stats):
+    snapshot = metrics.snapshot(stats)
     try:
-        return socket.gethostbyname(host)
-    except:
-        return None
+        write_atomic(METRICS_FILE, json.dumps(snapshot, indent=2))
+        if PROMETHEUS_TEXTFILE:
+            write_atomic(PROMETHEUS_TEXTFILE, metrics.to_prometheus(snapshot))
+        log(f"Run metrics written to {METRICS_FILE} ({snapshot['run_seconds']}s, {snapshot['probes_per_second']} probes/s).")
+    except Exception as e:
+        log(f"Error writing metrics: {e}")
 
-def test_tcp_socket(host, port, timeout):
+def run_profiled(func):
+    modes = {mode.strip() for mode in PROFILE_RUN.split(",") if mode.strip()}
+    if not modes:
+        return func()
+    profiler = None
+    if "tracemalloc" in modes:
+        import tracemalloc
+        tracemalloc.start(25)
+    if "cprofile" in modes:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     try:
-        sock = socket.create_connection((host, port), timeout=timeout)
-        sock.settimeout(1)
-        try:
-            sock.send(b"\x00")
-            sock.recv(1)
-        except:
-            pass
-        sock.close()
-        return True
-    except:
-        return False
+        return func()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_path = os.path.join(PROFILE_DIR, "profile.pstats")
+            profiler.dump_stats(profile_path)
+            log(f"cProfile stats written to {profile_path}")
+        if "tracemalloc" in modes:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            trace_path = os.path.join(PROFILE_DIR, "tracemalloc.txt")
+            with open(trace_path, "w", encoding="utf-8") as f:
+                f.write(f"current={current} peak={peak}\n")
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{stat}\n")
+            log(f"tracemalloc top allocations written to {trace_path}")
+
+Bridge = namedtuple("Bridge", ["line", "transport", "host", "port", "family", "fingerprint", "cert", "iat_mode", "url", "key"])
 
-def test_ssl_socket(host, port, timeout):
+BRIDGE_LINE_RE = re.compile(
+    r'^(?:(?P<transport>[a-z][\w-]*)\s+)?'
+    r'(?:\[(?P<ipv6>[0-9a-f:.]+)\]|(?P<ipv4>\d{1,3}(?:\.\d{1,3}){3})):(?P<port>\d{1,5})'
+    r'(?:\s+(?P<fingerprint>[0-9a-f]{40}))?'
+    r'(?P<args>(?:\s+\S+)*)\s*$',
+    re.IGNORECASE,
+)
+URL_HOST_RE = re.compile(r'^(?:(?P<scheme>https?)://)?(?:\[(?P<ipv6>[0-9a-f:.]+)\]|(?P<host>[^/:?#]+))(?::(?P<port>\d{1,5}))?', re.IGNORECASE)
+
+def is_ip_literal(host, family):
     try:
-        sock = socket.create_connection((host, port), timeout=timeout)
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        context.minimum_version = ssl.TLSVersion.TLSv1_2
-        ssl_sock = context.wrap_socket(sock, server_hostname=host)
-        ssl_sock.settimeout(SSL_TIMEOUT)
-        try:
-            ssl_sock.send(b"GET / HTTP/1.0\r\n\r\n")
-            ssl_sock.recv(1024)
-        except:
-            pass
-        ssl_sock.close()
+        socket.inet_pton(family, host)
         return True
-    except:
+    except (OSError, ValueError):
         return False
 
-def advanced_connection_test(bridge_line):
-    host, port, transport = extract_connection_info(bridge_line)
-    if not host or not port:
-        return False
-    if transport == "webtunnel":
-        test_func = test_ssl_socket
-        timeout = CONNECTION_TIMEOUT
-        default_port = 443
-    else:
-        test_func = test_tcp_socket
-        timeout = CONNECTION_TIMEOUT
-        default_port = 9001 if transport == "obfs4" else 443
-    if port == 0:
-        port = default_port
-    test_hosts = []
-    if is_valid_ip(host):
-        test_hosts.append(host)
+def match_bridge_line(line):
+    line = line.strip()
+    if len(line) < 10 or line.startswith("#"):
+        return None
+    match = BRIDGE_LINE_RE.match(line)
+    if not match:
+        return None
+    transport = (match.group("transport") or "vanilla").lower()
+    args = {}
+    for token in match.group("args").split():
+        name, sep, value = token.partition("=")
+        if sep:
+            args[name.lower()] = value
+    url = args.get("url")
+    if url:
+        url_match = URL_HOST_RE.match(url)
+        if not url_match:
+            return None
+        host = url_match.group("ipv6") or url_match.group("host")
+        default_port = 80 if (url_match.group("scheme") or "").lower() == "http" else 443
+        port = int(url_match.group("port") or default_port)
+        family = "IPv6" if url_match.group("ipv6") else ("IPv4" if is_ip_literal(host, socket.AF_INET) else "domain")
+    elif transport == "webtunnel":
+        return None
     else:
-        resolved = resolve_host(host)
-        if resolved:
-            test_hosts.append(resolved)
-        test_hosts.append(host)
-    for test_host in test_hosts:
-        for attempt in range(MAX_RETRIES):
-            try:
-                if test_func(test_host, port, timeout):
-                    return True
-            except:
-                pass
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(0.3 * (attempt + 1))
-    return False
+        host = match.group("ipv6") or match.group("ipv4")
+        port = int(match.group("port"))
+        family = "IPv6" if match.group("ipv6") else "IPv4"
+        if not is_ip_literal(host, socket.AF_INET6 if family == "IPv6" else socket.AF_INET):
+            return None
+    if not 0 < port < 65536:
+        return None
+    return line, transport, host, port, family, match, args
 
-def smart_bridge_filter(bridge_list, transport_type):
-    if not bridge_list:
-        return []
-    if len(bridge_list) > MAX_TEST_PER_TYPE:
-        bridge_list = bridge_list[:MAX_TEST_PER_TYPE]
+@lru_cache(maxsize=1 << 16)
+def parse_bridge_line(line):
+    fields = match_bridge_line(line)
+    if fields is None:
+        return None
+    line, transport, host, port, family, match, args = fields
+    fingerprint = match.group("fingerprint")
+    return Bridge(
+        line=line,
+        transport=transport,
+        host=host,
+        port=port,
+        family=family,
+        fingerprint=fingerprint.upper() if fingerprint else None,
+        cert=args.get("cert"),
+        iat_mode=args.get("iat-mode"),
+        url=args.get("url"),
+        key=" ".join(line.split()).lower(),
+    )
+
+def is_valid_bridge_line(line):
+    return parse_bridge_line(line) is not None
+
+def extract_connection_info(line):
+    bridge = parse_bridge_line(line)
+    if bridge is None:
+        return None, None, None
+    return bridge.host, bridge.port, bridge.transport
+
+def parse_bridge_lines(lines):
+    bridges = set()
+    for line in lines:
+        bridge = parse_bridge_line(line)
+        if bridge is not None:
+            bridges.add(bridge)
+    return bridges
+
+FAMILY_CODES = {"IPv4": 0, "IPv6": 1, "domain": 2}
+FAMILY_NAMES = tuple(FAMILY_CODES)
+
+class BridgeTable:
+    def __init__(self):
+        self.ids = {}
+        self.lines = []
+        self.transports = []
+        self.transport_codes = {}
+        self.kinds = bytearray()
+        self.hosts = []
+        self.ports = array("H")
+        self.families = bytearray()
+        self.first_seen = array("q")
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, line):
+        bridge_id = self.ids.get(line)
+        if bridge_id is not None:
+            return bridge_id
+        fields = match_bridge_line(line)
+        if fields is None:
+            return None
+        return self.intern(*fields[:5])
+
+    def add_bridge(self, bridge):
+        bridge_id = self.ids.get(bridge.line)
+        if bridge_id is not None:
+            return bridge_id
+        return self.intern(bridge.line, bridge.transport, bridge.host, bridge.port, bridge.family)
+
+    def intern(self, line, transport, host, port, family):
+        bridge_id = self.ids.get(line)
+        if bridge_id is not None:
+            return bridge_id
+        code = self.transport_codes.get(transport)
+        if code is None:
+            code = self.transport_codes[transport] = len(self.transports)
+            self.transports.append(transport)
+        bridge_id = self.ids[line] = len(self.lines)
+        self.lines.append(line)
+        self.kinds.append(code)
+        self.hosts.append(sys.intern(host) if family == "domain" else host)
+        self.ports.append(port)
+        self.families.append(FAMILY_CODES[family])
+        self.first_seen.append(0)
+        return bridge_id
+
+    def bridge(self, bridge_id):
+        return parse_bridge_line(self.lines[bridge_id])
+
+    def transport(self, bridge_id):
+        return self.transports[self.kinds[bridge_id]]
+
+    def endpoint(self, bridge_id, ip="IPv4"):
+        family = FAMILY_NAMES[self.families[bridge_id]]
+        kind = "tls" if self.transports[self.kinds[bridge_id]] == "webtunnel" else "tcp"
+        return (kind, self.hosts[bridge_id], self.ports[bridge_id], ip if family == "domain" else family)
+
+    def load_first_seen(self, rows, add=False):
+        for line, first_seen in rows:
+            bridge_id = self.add(line) if add else self.ids.get(line)
+            if bridge_id is not None:
+                self.first_seen[bridge_id] = first_seen
+
+class BridgeSet:
+    def __init__(self, table, ids=()):
+        self.table = table
+        self.items = array("l")
+        self.members = bytearray()
+        self.update(ids)
+
+    def update(self, ids):
+        members = self.members
+        new_ids = []
+        for bridge_id in ids:
+            if bridge_id is None:
+                continue
+            if bridge_id >= len(members):
+                members.extend(bytes(len(self.table) - len(members)))
+            if not members[bridge_id]:
+                members[bridge_id] = 1
+                new_ids.append(bridge_id)
+        if new_ids:
+            lines = self.table.lines
+            new_ids.sort(key=lines.__getitem__)
+            if not self.items or lines[self.items[-1]] < lines[new_ids[0]]:
+                self.items.extend(new_ids)
+            else:
+                self.items = array("l", heapq.merge(self.items, new_ids, key=lines.__getitem__))
+        return new_ids
+
+    def lines(self):
+        lines = self.table.lines
+        return (lines[bridge_id] for bridge_id in self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, bridge_id):
+        return bridge_id < len(self.members) and self.members[bridge_id] == 1
+
+bridge_table = BridgeTable()
+
+ProbeTiming = namedtuple("ProbeTiming", ["connect_ms", "handshake_ms"])
+
+def probe_priority(entry, recent, now):
+    # Never-probed first, then fresh bridges, then the coverage rotation, then the rest by score
+    if entry is None:
+        return (0, 0 if recent else 1, 0.0)
+    score, failures, last_checked = entry
+    age = now - last_checked
+    if failures and age < min(2 ** (failures - 1) * 3600, PROBE_BACKOFF_MAX_HOURS * 3600):
+        return None
+    if recent:
+        return (1, 0, -score)
+    if age >= PROBE_COVERAGE_HOURS * 3600:
+        return (2, -age, 0.0)
+    return (3, 0, -score)
+
+def dedupe_bridges(bridges, limit=None):
     unique_bridges = []
     seen = set()
-    for bridge in bridge_list:
-        key = re.sub(r'\s+', ' ', bridge.strip()).lower()
-        if key not in seen:
-            seen.add(key)
+    for bridge in bridges:
+        if limit is not None and len(unique_bridges) >= limit:
+            break
+        if bridge.key not in seen:
+            seen.add(bridge.key)
             unique_bridges.append(bridge)
     return unique_bridges
 
-def batch_test_bridges(bridge_list, transport_type, batch_size=100):
+def smart_bridge_filter(bridge_list, transport_type):
     if not bridge_list:
         return []
-    filtered_bridges = smart_bridge_filter(bridge_list, transport_type)
-    if not filtered_bridges:
-        return []
-    working_bridges = []
-    total = len(filtered_bridges)
-    for i in range(0, total, batch_size):
-        batch = filtered_bridges[i:i + batch_size]
-        batch_working = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batch))) as executor:
-            future_to_bridge = {executor.submit(advanced_connection_test, bridge): bridge for bridge in batch}
-            for future in concurrent.futures.as_completed(future_to_bridge):
-                bridge = future_to_bridge[future]
-                try:
-                    if future.result():
-                        batch_working.append(bridge)
-                except:
-                    pass
-        working_bridges.extend(batch_working)
-        if len(batch_working) > 0:
-            log(f"   Batch {i//batch_size + 1}: {len(batch_working)}/{len(batch)} bridges working")
-    return working_bridges
-
-def load_history():
-    if os.path.exists(HISTORY_FILE):
+    return dedupe_bridges(bridge_list)[:MAX_TEST_PER_TYPE]
+
+def recent_cutoff():
+    return int((datetime.now() - timedelta(hours=RECENT_HOURS)).timestamp())
+
+def select_candidates(archive, probe_stats, ip="IPv4", limit=None):
+    table = archive.table
+    limit = limit or MAX_TEST_PER_TYPE
+    if not probe_stats:
+        return dedupe_bridges((table.bridge(bridge_id) for bridge_id in archive), limit)
+    now = int(time.time())
+    cutoff = recent_cutoff()
+    lines = table.lines
+    first_seen = table.first_seen
+
+    def ranked():
+        for bridge_id in archive:
+            priority = probe_priority(probe_stats.get(table.endpoint(bridge_id, ip)), first_seen[bridge_id] > cutoff, now)
+            if priority is not None:
+                yield priority, lines[bridge_id], bridge_id
+
+    picked = heapq.nsmallest(limit, ranked())
+    bridges = dedupe_bridges(table.bridge(bridge_id) for _, _, bridge_id in picked)
+    if len(bridges) < len(picked):
+        bridges = dedupe_bridges((table.bridge(bridge_id) for _, _, bridge_id in sorted(ranked())), limit)
+    return bridges
+
+def probe_endpoint_key(bridge, ip="IPv4"):
+    kind = "tls" if bridge.transport == "webtunnel" else "tcp"
+    return (kind, bridge.host, bridge.port, ip if bridge.family == "domain" else bridge.family)
+
+def summarize_groups(groups):
+    rows = {}
+    for key, group in groups.items():
+        row = rows[key] = {name: group[name] for name in ("reachable", "working", "failed", "skipped")}
+        if row["reachable"] is None and group.get("ready") is not None and group["ready"].done():
+            row["reachable"] = group["ready"].result()
+    return rows
+
+def merge_group_rows(groups, rows):
+    for key, row in rows.items():
+        group = groups.setdefault(key, {"reachable": None, "working": 0, "failed": 0, "skipped": 0})
+        for name in ("working", "failed", "skipped"):
+            group[name] += row[name]
+        if row["reachable"] is not None:
+            group["reachable"] = bool(group["reachable"]) or row["reachable"]
+
+def report_groups(groups, limit=10):
+    rows = summarize_groups(groups)
+    blocked = sorted(
+        ((key, row) for key, row in rows.items() if row["reachable"] is False),
+        key=lambda item: (-item[1]["skipped"], item[0]),
+    )
+    skipped = sum(row["skipped"] for row in rows.values())
+    log(f"Probe groups: {len(rows)} groups, {len(blocked)} unreachable, {skipped} endpoints skipped: group unreachable")
+    for key, row in blocked[:limit]:
+        log(f"   {key}: unreachable ({row['failed']} canaries timed out, {row['skipped']} skipped)")
+    return {
+        "total": len(rows),
+        "unreachable": len(blocked),
+        "skipped": skipped,
+        "blocked": [{"group": key, "skipped": row["skipped"]} for key, row in blocked[:limit]],
+    }
+
+def format_endpoint_key(endpoint):
+    return "|".join(str(part) for part in endpoint)
+
+def parse_endpoint_key(key):
+    kind, host, port, family = key.split("|")
+    return (kind, host, int(port), family)
+
+def collect_endpoints(bridge_lists):
+    endpoints = {}
+    for bridges in bridge_lists:
+        for bridge in bridges:
+            endpoints.setdefault(probe_endpoint_key(bridge), bridge)
+    return endpoints
+
+def encode_probe_results(results, cutoff=0):
+    return {
+        format_endpoint_key(endpoint): [checked_at, bool(timing)] + list(timing or (None, None))
+        for endpoint, (checked_at, timing) in sorted(results.items())
+        if checked_at > cutoff
+    }
+
+def decode_probe_results(raw, cutoff=0):
+    results = {}
+    for key, entry in raw.items():
+        if len(entry) == 4 and entry[0] > cutoff and key.count("|") == 3:
+            checked_at, working, connect_ms, handshake_ms = entry
+            results[parse_endpoint_key(key)] = (checked_at, ProbeTiming(connect_ms, handshake_ms) if working else None)
+    return results
+
+def load_probe_cache():
+    if os.path.exists(PROBE_CACHE_FILE):
         try:
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(PROBE_CACHE_FILE, "r", encoding="utf-8") as f:
+                return decode_probe_results(json.load(f), time.time() - PROBE_CACHE_TTL)
         except Exception as e:
-            log(f"Error loading history: {e}")
+            log(f"Error loading probe cache: {e}")
+            return {}
+    return {}
+
+def save_probe_cache(cache):
+    raw = encode_probe_results(cache, time.time() - PROBE_CACHE_TTL)
+    try:
+        write_atomic(PROBE_CACHE_FILE, json.dumps(raw, separators=(",", ":")))
+    except Exception as e:
+        log(f"Error saving probe cache: {e}")
+
+def load_probe_stats():
+    if os.path.exists(PROBE_STATS_FILE):
+        try:
+            with open(PROBE_STATS_FILE, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            probe_stats = {}
+            for key, entry in raw.items():
+                if key.count("|") == 3:
+                    probe_stats[parse_endpoint_key(key)] = entry
+            return probe_stats
+        except Exception as e:
+            log(f"Error loading probe stats: {e}")
             return {}
     return {}
 
+def save_probe_stats(probe_stats):
+    cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+    raw = {
+        format_endpoint_key(endpoint): entry
+        for endpoint, entry in sorted(probe_stats.items())
+        if entry[2] > cutoff
+    }
+    try:
+        write_atomic(PROBE_STATS_FILE, json.dumps(raw, separators=(",", ":")))
+    except Exception as e:
+        log(f"Error saving probe stats: {e}")
+
+def update_probe_stats(probe_stats, endpoint, working, now):
+    score, failures, _ = probe_stats.get(endpoint, (0.5, 0, 0))
+    score = PROBE_SCORE_DECAY * score + (1 - PROBE_SCORE_DECAY) * working
+    failures = 0 if working else failures + 1
+    probe_stats[endpoint] = [round(score, 4), failures, now]
+
+def shard_of(endpoint, count):
+    digest = hashlib.blake2b(format_endpoint_key(endpoint).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected 0 <= i < N")
+    return index, count
+
+def plan_probe_endpoints(archives, probe_state, count_probed=True):
+    candidates = {}
+    endpoints = {}
+    unique = set()
+    fresh = time.time() - PROBE_CACHE_TTL
+    for target in TARGETS:
+        archive = archives.get(target["file"])
+        bridges = select_candidates(archive, probe_state["stats"], target["ip"]) if archive else []
+        candidates[target["file"]] = bridges
+        for bridge in bridges:
+            endpoint = probe_endpoint_key(bridge, target["ip"])
+            unique.add(endpoint)
+            entry = probe_state["cache"].get(endpoint)
+            if entry is None or entry[0] <= fresh:
+                endpoints.setdefault(endpoint, bridge)
+        probe_state["candidates"] += len(bridges)
+    probe_state["cached"] += len(unique) - len(endpoints)
+    if count_probed:
+        probe_state["probed"] += len(endpoints)
+    return candidates, endpoints
+
+def merge_probe_results(probe_state, results):
+    cache = probe_state["cache"]
+    for endpoint, (checked_at, timing) in results.items():
+        if endpoint in cache and cache[endpoint][0] >= checked_at:
+            continue
+        cache[endpoint] = (checked_at, timing)
+        if probe_state["stats"].get(endpoint, (0, 0, 0))[2] < checked_at:
+            update_probe_stats(probe_state["stats"], endpoint, bool(timing), checked_at)
+
+def candidate_timings(target, candidates, probe_state):
+    cache = probe_state["cache"]
+    timings = {}
+    for bridge in candidates:
+        entry = cache.get(probe_endpoint_key(bridge, target["ip"]))
+        if entry and entry[1]:
+            timings[bridge] = entry[1]
+    return timings
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(round(fraction * len(sorted_values), 9)) - 1))
+    return sorted_values[index]
+
+def summarize_latency(probe_state):
+    summary = {}
+    for transport, rtts in sorted(probe_state["rtts"].items()):
+        values = sorted(rtts.values())
+        if not values:
+            continue
+        summary[transport] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5),
+            "p90_ms": percentile(values, 0.9),
+            "p99_ms": percentile(values, 0.99),
+        }
+        log(f"   {transport} connect RTT: p50 {summary[transport]['p50_ms']} ms, p90 {summary[transport]['p90_ms']} ms, p99 {summary[transport]['p99_ms']} ms (n={len(values)})")
+    return summary
+
+def to_epoch(value):
+    return int(datetime.fromisoformat(value).timestamp())
+
+class JsonHistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line, first_seen in json.load(f).items():
+                    try:
+                        self.entries[line] = to_epoch(first_seen)
+                    except ValueError:
+                        pass
+
+    def record_seen(self, lines, now):
+        for line in lines:
+            self.entries.setdefault(line, now)
+
+    def seen_since(self, cutoff):
+        return {line for line, first_seen in self.entries.items() if first_seen > cutoff}
+
+    def iter_first_seen(self, cutoff=0):
+        return ((line, first_seen) for line, first_seen in self.entries.items() if first_seen > cutoff)
+
+    def first_seen_for(self, lines):
+        return ((line, self.entries[line]) for line in lines if line in self.entries)
+
+    def cleanup(self, cutoff):
+        self.entries = {line: first_seen for line, first_seen in self.entries.items() if first_seen > cutoff}
+
+    def save(self):
+        history = {line: datetime.fromtimestamp(first_seen).isoformat() for line, first_seen in self.entries.items()}
+        outputs.write(self.path, json.dumps(history, indent=2))
+
+    def close(self):
+        pass
+
+class SqliteHistoryStore:
+    def __init__(self, path, read_only=False):
+        import sqlite3
+        self.path = path
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bridges (
+                line TEXT PRIMARY KEY,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS bridges_first_seen ON bridges (first_seen);
+        """)
+
+    def record_seen(self, lines, now):
+        self.conn.executemany(
+            "INSERT INTO bridges (line, first_seen, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT (line) DO UPDATE SET last_seen = excluded.last_seen "
+            "WHERE excluded.last_seen >= bridges.last_seen + ?",
+            ((line, now, now, HISTORY_LAST_SEEN_STEP) for line in lines),
+        )
+
+    def seen_since(self, cutoff):
+        return {row[0] for row in self.conn.execute("SELECT line FROM bridges WHERE first_seen > ?", (cutoff,))}
+
+    def iter_first_seen(self, cutoff=0):
+        return self.conn.execute("SELECT line, first_seen FROM bridges WHERE first_seen > ?", (cutoff,))
+
+    def first_seen_for(self, lines):
+        lines = list(lines)
+        for start in range(0, len(lines), 500):
+            chunk = lines[start:start + 500]
+            yield from self.conn.execute(f"SELECT line, first_seen FROM bridges WHERE line IN ({','.join('?' * len(chunk))})", chunk)
+
+    def cleanup(self, cutoff):
+        self.conn.execute("DELETE FROM bridges WHERE first_seen <= ?", (cutoff,))
+
+    def save(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def migrate_json_history(store):
+    legacy = JsonHistoryStore(HISTORY_FILE)
+    legacy.load()
+    by_time = {}
+    for line, first_seen in legacy.entries.items():
+        by_time.setdefault(first_seen, []).append(line)
+    for first_seen, lines in by_time.items():
+        store.record_seen(lines, first_seen)
+    store.save()
+    os.remove(HISTORY_FILE)
+    log(f"Migrated {len(legacy.entries)} history entries from {HISTORY_FILE} to {HISTORY_DB}.")
+
+def load_history(read_only=False):
+    if read_only and HISTORY_BACKEND != "json" and os.path.exists(HISTORY_DB):
+        return SqliteHistoryStore(HISTORY_DB, read_only=True)
+    if read_only or HISTORY_BACKEND == "json":
+        store = JsonHistoryStore(HISTORY_FILE)
+        try:
+            store.load()
+        except Exception as e:
+            log(f"Error loading history: {e}")
+        return store
+    needs_migration = not os.path.exists(HISTORY_DB) and os.path.exists(HISTORY_FILE)
+    store = SqliteHistoryStore(HISTORY_DB)
+    if needs_migration:
+        try:
+            migrate_json_history(store)
+        except Exception as e:
+            log(f"Error migrating history: {e}")
+    return store
+
 def save_history(history):
     try:
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2)
+        with metrics.timer("history_save"):
+            history.save()
     except Exception as e:
         log(f"Error saving history: {e}")
 
 def cleanup_history(history):
     cutoff = datetime.now() - timedelta(days=HISTORY_RETENTION_DAYS)
-    new_history = {
-        k: v for k, v in history.items() 
-        if datetime.fromisoformat(v) > cutoff
-    }
-    return new_history
+    history.cleanup(int(cutoff.timestamp()))
+    return history
 
 def update_readme(stats):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M UTC")
@@ -257,6 +876,15 @@ These bridges from the archive have passed a TCP connectivity test (3 retries, 1
 | **WebTunnel** | [webtunnel_tested.txt]({REPO_URL}/bridge/webtunnel_tested.txt) | **{stats.get('webtunnel_tested.txt', 0)}** |
 | **Vanilla** | [vanilla_tested.txt]({REPO_URL}/bridge/vanilla_tested.txt) | **{stats.get('vanilla_tested.txt', 0)}** |
 
+### Fastest (Lowest Latency)
+The {FASTEST_LIMIT} tested bridges with the lowest connect time from the collector, nearest first.
+
+| Transport | IPv4 (Fastest) | Count |
+| :--- | :--- | :--- |
+| **obfs4** | [obfs4_fastest.txt]({REPO_URL}/bridge/obfs4_fastest.txt) | **{stats.get('obfs4_fastest.txt', 0)}** |
+| **WebTunnel** | [webtunnel_fastest.txt]({REPO_URL}/bridge/webtunnel_fastest.txt) | **{stats.get('webtunnel_fastest.txt', 0)}** |
+| **Vanilla** | [vanilla_fastest.txt]({REPO_URL}/bridge/vanilla_fastest.txt) | **{stats.get('vanilla_fastest.txt', 0)}** |
+
 ### Fresh Bridges (Last 72 Hours)
 Bridges discovered within the last 3 days.
 
@@ -288,186 +916,636 @@ Your stars fuel our motivation to keep improving!
 ## Disclaimer
 This project is for educational and archival purposes. Please use these bridges responsibly.
 """
-    with open("README.md", "w", encoding="utf-8") as f:
-        f.write(readme_content)
-    log("README.md updated with latest statistics.")
+    if outputs.write("README.md", readme_content):
+        log("README.md updated with latest statistics.")
+
+ZipEntry = namedtuple("ZipEntry", "crc compressed size data")
+
+ZIP_DOS_DATE = (0 << 9) | (1 << 5) | 1
+ZIP_DEFLATED = 8
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+
+def zip_arcname(file):
+    if file.endswith("_tested.txt"):
+        folder = "Tested"
+    elif file.endswith("_fastest.txt"):
+        folder = "Fastest"
+    elif file.endswith(f"_{RECENT_HOURS}h.txt"):
+        folder = "Recent 72h"
+    else:
+        folder = "Full Archive"
+    return f"Tor Bridges/{folder}/{file}"
+
+def read_zip_entries(zip_path):
+    import zipfile
+    entries = {}
+    if not os.path.exists(zip_path):
+        return entries
+    try:
+        with zipfile.ZipFile(zip_path) as zipf, open(zip_path, "rb") as f:
+            for info in zipf.infolist():
+                if info.compress_type != ZIP_DEFLATED or len(info.comment) != 64:
+                    continue
+                f.seek(info.header_offset)
+                header = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+                f.seek(header[-2] + header[-1], os.SEEK_CUR)
+                entries[info.comment.decode("ascii")] = ZipEntry(info.CRC, info.compress_size, info.file_size, f.read(info.compress_size))
+    except Exception as e:
+        log(f"Could not reuse entries from {zip_path}: {e}")
+        return {}
+    return entries
+
+def compress_entry(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return ZipEntry(zlib.crc32(data), len(compressed), len(data), compressed)
+
+def build_zip(zip_path, files):
+    from concurrent.futures import ThreadPoolExecutor
+    cached = read_zip_entries(zip_path)
+    contents = []
+    for arcname, file_path in sorted(files):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        contents.append((arcname, hashlib.sha256(data).hexdigest(), data))
+
+    pending = {digest: data for _, digest, data in contents if digest not in cached}
+    with ThreadPoolExecutor(max_workers=ZIP_WORKERS) as executor:
+        cached.update(zip(pending, executor.map(compress_entry, pending.values())))
+
+    body = bytearray()
+    central = bytearray()
+    for arcname, digest, _ in contents:
+        entry = cached[digest]
+        name = arcname.encode("utf-8")
+        central += ZIP_CENTRAL_HEADER.pack(b"PK\x01\x02", 20, 20, 0x800, ZIP_DEFLATED, 0, ZIP_DOS_DATE, entry.crc, entry.compressed, entry.size, len(name), 0, len(digest), 0, 0, 0o644 << 16, len(body))
+        central += name + digest.encode("ascii")
+        body += ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", 20, 0x800, ZIP_DEFLATED, 0, ZIP_DOS_DATE, entry.crc, entry.compressed, entry.size, len(name), 0)
+        body += name + entry.data
+    archive = bytes(body + central + ZIP_END_RECORD.pack(b"PK\x05\x06", 0, 0, len(contents), len(contents), len(central), len(body), 0))
+
+    digest = hashlib.sha256(archive).hexdigest()
+    if outputs.digest_on_disk(zip_path) != bytes.fromhex(digest):
+        tmp_path = zip_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(archive)
+        os.replace(tmp_path, zip_path)
+        outputs.digests[zip_path] = bytes.fromhex(digest)
+        outputs.changed.add(zip_path)
+    log(f"Created ZIP archive: {zip_path} ({len(pending)} entries compressed, {len(contents) - len(pending)} reused, sha256 {digest[:12]})")
+    return digest
+
+def load_upload_state():
+    if os.path.exists(UPLOAD_STATE_FILE):
+        try:
+            with open(UPLOAD_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log(f"Error loading upload state: {e}")
+    return {}
+
+def save_upload_state(digest):
+    outputs.write(UPLOAD_STATE_FILE, json.dumps({"digest": digest, "uploaded_at": int(time.time())}, indent=2))
+
+class MultipartFile:
+    def __init__(self, fields, field_name, file_path, chunk_size=64 * 1024):
+        self.boundary = hashlib.sha256(os.urandom(16)).hexdigest()
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        head = "".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{os.path.basename(file_path)}"\r\nContent-Type: application/zip\r\n\r\n'
+        self.head = head.encode("utf-8")
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self.head) + os.path.getsize(self.file_path) + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        with open(self.file_path, "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        yield self.tail
 
 def send_to_telegram(file_path, caption):
+    import requests
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         log("Telegram credentials missing.")
-        return
+        return False
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument"
-    try:
-        with open(file_path, 'rb') as f:
-            response = requests.post(url, data={'chat_id': TELEGRAM_CHAT_ID, 'caption': caption, 'parse_mode': 'Markdown'}, files={'document': f})
+    for attempt in range(UPLOAD_RETRIES):
+        delay = 2 ** attempt
+        try:
+            body = MultipartFile({'chat_id': TELEGRAM_CHAT_ID, 'caption': caption, 'parse_mode': 'Markdown'}, 'document', file_path)
+            response = requests.post(url, data=body, headers={'Content-Type': body.content_type}, timeout=UPLOAD_TIMEOUT)
             if response.status_code == 200:
                 log(f"Telegram upload successful: {os.path.basename(file_path)}")
-            else:
-                log(f"Telegram upload failed: {response.status_code}")
+                return True
+            log(f"Telegram upload failed: {response.status_code}")
+            if response.status_code != 429 and response.status_code < 500:
+                return False
+            delay = max(delay, int(response.headers.get("Retry-After", 0) or 0))
+        except Exception as e:
+            log(f"Telegram Error: {e}")
+        if attempt + 1 < UPLOAD_RETRIES:
+            time.sleep(delay)
+    return False
+
+class BridgeLinesParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.found = False
+        self.closed = False
+        self.buffer = []
+        self.lines = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.closed:
+            return
+        if self.depth:
+            if tag == "div":
+                self.depth += 1
+            elif tag == "br":
+                self.flush()
+        elif tag == "div" and dict(attrs).get("id") == "bridgelines":
+            self.found = True
+            self.depth = 1
+
+    def handle_endtag(self, tag):
+        if self.depth and tag == "div":
+            self.depth -= 1
+            if not self.depth:
+                self.flush()
+                self.closed = True
+
+    def handle_data(self, data):
+        if self.depth:
+            self.buffer.append(data)
+
+    def flush(self):
+        for line in "".join(self.buffer).split("\n"):
+            line = line.strip()
+            if line:
+                self.lines.append(line)
+        self.buffer = []
+
+def iter_bridge_lines(chunks):
+    parser = BridgeLinesParser()
+    unmatched = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        if not parser.found:
+            unmatched.append(chunk)
+        elif unmatched:
+            unmatched = []
+        while parser.lines:
+            yield parser.lines.pop(0)
+        if parser.closed:
+            return
+    if parser.found:
+        parser.flush()
+        yield from parser.lines
+        return
+    yield from extract_bridge_lines_fallback("".join(unmatched))
+
+def extract_bridge_lines_fallback(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    bridge_div = soup.find(id="bridgelines") or soup.find(class_="bridge-lines")
+    if not bridge_div:
+        raise LookupError("no bridge container")
+    log("Warning: bridge container layout changed, used BeautifulSoup fallback.")
+    raw_text = bridge_div.get_text("\n")
+    for line in raw_text.split("\n"):
+        line = line.strip()
+        if line:
+            yield line
+
+def iter_response_text(response, chunk_size=8192):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def retry_after_seconds(value):
+    from email.utils import parsedate_to_datetime
+    if not value:
+        return 0
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+def fetch_backoff(attempt, retry_after=0):
+    return max(retry_after, random.uniform(0, min(FETCH_BACKOFF_MAX, FETCH_BACKOFF * 2 ** attempt)))
+
+@contextmanager
+def drained(response):
+    # Read whatever the parser left unread so the connection goes back to the pool
+    try:
+        yield
+    finally:
+        try:
+            response.raw.drain_conn()
+        except Exception:
+            pass
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def load_fetch_state():
+    if os.path.exists(FETCH_STATE_FILE):
+        try:
+            with open(FETCH_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log(f"Error loading fetch state: {e}")
+    return {}
+
+def save_fetch_state(state):
+    try:
+        write_atomic(FETCH_STATE_FILE, json.dumps(state, indent=2, sort_keys=True))
     except Exception as e:
-        log(f"Telegram Error: {e}")
+        log(f"Error saving fetch state: {e}")
+
+class Fetcher:
+    def __init__(self, base_interval=FETCH_BASE_INTERVAL, slack=FETCH_SLACK, force=False, state=None, targets=None, rate=FETCH_RATE, burst=FETCH_BURST):
+        self.session = create_session()
+        self.bucket = TokenBucket(rate, burst)
+        self.base_interval = base_interval
+        self.slack = slack
+        self.force = force
+        self.state = load_fetch_state() if state is None else state
+        self.targets = TARGETS if targets is None else targets
+
+    def entry(self, target):
+        return self.state.setdefault(target["file"], {})
+
+    def weight(self, target):
+        return self.state.get(target["file"], {}).get("yield", 0) + FETCH_YIELD_SMOOTHING
+
+    def interval(self, target):
+        # Spend the same number of requests as fetching every target once per base interval, weighted by yield
+        mean = sum(self.weight(other) for other in self.targets) / len(self.targets)
+        interval = self.base_interval * mean / self.weight(target)
+        return min(self.base_interval * FETCH_INTERVAL_MAX, max(self.base_interval * FETCH_INTERVAL_MIN, interval))
+
+    def next_fetch(self, target):
+        entry = self.state.get(target["file"], {})
+        if "retry_at" in entry:
+            return entry["retry_at"]
+        fetched_at = entry.get("fetched_at")
+        if fetched_at is None:
+            return 0
+        return fetched_at + self.interval(target) * (1 - self.slack)
 
-def main():
+    def due(self, target, now=None):
+        now = time.time() if now is None else now
+        return self.force or self.next_fetch(target) <= now
+
+    def next_due(self):
+        return min(self.next_fetch(target) for target in self.targets)
+
+    def fetch(self, target):
+        import requests
+        entry = self.entry(target)
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        error = None
+        retry_after = 0
+        for attempt in range(FETCH_RETRIES + 1):
+            if attempt:
+                if retry_after > FETCH_BACKOFF_MAX:
+                    break
+                delay = fetch_backoff(attempt - 1, retry_after)
+                log(f"Retrying {target['file']} in {delay:.1f}s after {error}")
+                metrics.incr("fetch_retries")
+                time.sleep(delay)
+            self.bucket.acquire()
+            metrics.incr("fetch_requests")
+            try:
+                with metrics.timer("fetch", "fetch_seconds"), self.session.get(target["url"], headers=headers, timeout=FETCH_TIMEOUT, stream=True) as response, drained(response):
+                    if response.status_code == 304:
+                        metrics.incr("fetch_not_modified")
+                        return None
+                    if response.status_code == 429 or response.status_code >= 500:
+                        error = f"status {response.status_code}"
+                        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                        continue
+                    response.raise_for_status()
+                    try:
+                        lines = list(iter_bridge_lines(iter_response_text(response)))
+                    except LookupError:
+                        log(f"Warning: No bridge container for {target['file']}.")
+                        return []
+                    for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+                        if response.headers.get(header):
+                            entry[key] = response.headers[header]
+                        else:
+                            entry.pop(key, None)
+                    return lines
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                retry_after = 0
+        raise RuntimeError(f"giving up on {target['url']} after {error}")
+
+    def record(self, target, new_bridges, now=None):
+        entry = self.entry(target)
+        now = int(time.time() if now is None else now)
+        if new_bridges is None:
+            # Keep the last good fetched_at and retry on the shortest interval
+            entry["retry_at"] = now + int(self.base_interval * FETCH_INTERVAL_MIN)
+            entry["failures"] = entry.get("failures", 0) + 1
+            return
+        entry.pop("retry_at", None)
+        entry["fetched_at"] = now
+        previous = entry.get("yield")
+        entry["yield"] = round(new_bridges if previous is None else FETCH_YIELD_DECAY * previous + (1 - FETCH_YIELD_DECAY) * new_bridges, 3)
+        entry["fetches"] = entry.get("fetches", 0) + 1
+        entry["new_bridges"] = entry.get("new_bridges", 0) + new_bridges
+        metrics.incr("bridges_new", new_bridges)
+
+    def save(self):
+        save_fetch_state(self.state)
+
+    def close(self):
+        self.session.close()
+
+def create_session():
+    import requests
     session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=len(TARGETS))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     session.headers.update({
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     })
-    
+    return session
+
+def output_filenames(filename):
+    return {
+        "archive": filename,
+        "recent": filename.replace(".txt", f"_{RECENT_HOURS}h.txt"),
+        "tested": filename.replace(".txt", "_tested.txt"),
+        "fastest": filename.replace(".txt", "_fastest.txt"),
+    }
+
+def write_bridge_file(filename, lines):
+    return outputs.write(os.path.join(BRIDGE_DIR, filename), "".join(line + "\n" for line in lines))
+
+def read_archive(filename, table=None):
+    table = bridge_table if table is None else table
+    bridge_path = os.path.join(BRIDGE_DIR, filename)
+    if os.path.exists(bridge_path):
+        try:
+            with open(bridge_path, "r", encoding="utf-8") as f, metrics.timer("parse"):
+                return BridgeSet(table, (table.add(line.strip()) for line in f))
+        except:
+            pass
+    return BridgeSet(table)
+
+def load_recent_history(history, table=None):
+    table = bridge_table if table is None else table
+    table.load_first_seen(history.iter_first_seen(recent_cutoff()), add=True)
+
+def update_archive(target, all_bridges, stats):
+    names = output_filenames(target["file"])
+    write_bridge_file(names["archive"], all_bridges.lines())
+    if all_bridges:
+        log(f"Processed {names['archive']}: Total {len(all_bridges)}")
+
+    cutoff = recent_cutoff()
+    first_seen = all_bridges.table.first_seen
+    lines = all_bridges.table.lines
+    recent_lines = [lines[bridge_id] for bridge_id in all_bridges if first_seen[bridge_id] > cutoff]
+    write_bridge_file(names["recent"], recent_lines)
+
+    stats[names["archive"]] = len(all_bridges)
+    stats[names["recent"]] = len(recent_lines)
+
+def cached_timings(target, all_bridges, probe_state, max_age):
+    cutoff = time.time() - max_age
+    cache = probe_state["cache"]
+    table = all_bridges.table
+    timings = {}
+    for bridge_id in all_bridges:
+        entry = cache.get(table.endpoint(bridge_id, target["ip"]))
+        if entry and entry[1] and entry[0] > cutoff:
+            timings[table.bridge(bridge_id)] = entry[1]
+    return timings
+
+def write_tested(target, timings, probe_state, stats):
+    names = output_filenames(target["file"])
+    tested_bridges = list(timings)
+    rtts = probe_state["rtts"].setdefault(target["type"], {})
+    for bridge, timing in timings.items():
+        rtts[probe_endpoint_key(bridge, target["ip"])] = timing.connect_ms
+
+    write_bridge_file(names["tested"], sorted(bridge.line for bridge in tested_bridges))
+    if tested_bridges:
+        log(f"   → {len(tested_bridges)} bridges passed connectivity test for {names['archive']}.")
+    else:
+        log(f"   → No bridges passed connectivity test for {names['archive']}.")
+
+    fastest_bridges = sorted(tested_bridges, key=lambda bridge: (timings[bridge].connect_ms, bridge.line))[:FASTEST_LIMIT]
+    write_bridge_file(names["fastest"], (bridge.line for bridge in fastest_bridges))
+
+    stats[names["tested"]] = len(tested_bridges)
+    stats[names["fastest"]] = len(fastest_bridges)
+
+def new_probe_state():
+    return {"cache": load_probe_cache(), "stats": load_probe_stats(), "inflight": {}, "groups": {}, "rtts": {}, "candidates": 0, "cached": 0, "probed": 0}
+
+def finish_probe_round(probe_state, stats):
+    save_probe_cache(probe_state["cache"])
+    save_probe_stats(probe_state["stats"])
+    log(f"Probe plan: {probe_state['candidates']} candidates, {probe_state['cached'] + probe_state['probed']} unique endpoints, {probe_state['cached']} cached, {probe_state['probed']} probed")
+    stats["latency"] = summarize_latency(probe_state)
+    stats["groups"] = report_groups(probe_state["groups"])
+    probe_state.update({"inflight": {}, "groups": {}, "candidates": 0, "cached": 0, "probed": 0})
+
+def log_target_errors(results):
+    for target, result in zip(TARGETS, results):
+        if isinstance(result, Exception):
+            log(f"Error processing {target['file']}: {result}")
+
+def write_planned_results(candidates, probe_state, stats):
+    for target in TARGETS:
+        write_tested(target, candidate_timings(target, candidates.get(target["file"], ()), probe_state), probe_state, stats)
+    finish_probe_round(probe_state, stats)
+
+def shard_output_path(index, count):
+    return os.path.join(SHARD_DIR, f"shard-{index}-of-{count}.json")
+
+def run_shard(index, count, output=None):
+    output = output or shard_output_path(index, count)
+    metrics.reset()
+    history = load_history()
+    load_recent_history(history)
+    history.close()
+    probe_state = new_probe_state()
+    archives = {target["file"]: read_archive(target["file"]) for target in TARGETS}
+    _, endpoints = plan_probe_endpoints(archives, probe_state)
+    endpoints = {endpoint: bridge for endpoint, bridge in endpoints.items() if shard_of(endpoint, count) == index}
+    log(f"Shard {index}/{count}: probing {len(endpoints)} endpoints")
+    from probe_engine import probe_shard_worker
+    results, _, _, groups = probe_shard_worker(endpoints)
+    write_atomic(output, json.dumps({"results": encode_probe_results(results), "groups": summarize_groups(groups)}, separators=(",", ":")))
+    log(f"Shard {index}/{count}: {sum(1 for _, timing in results.values() if timing)} of {len(results)} endpoints reachable, results written to {output}")
+    write_metrics({"groups": report_groups(groups)})
+
+def merge_shards(paths):
+    metrics.reset()
+    outputs.reset()
+    stats = {}
     history = load_history()
-    history = cleanup_history(history)
+    load_recent_history(history)
+    history.close()
+    probe_state = new_probe_state()
+    archives = {}
+    for target in TARGETS:
+        archives[target["file"]] = read_archive(target["file"])
+        update_archive(target, archives[target["file"]], stats)
+    candidates, _ = plan_probe_endpoints(archives, probe_state, count_probed=False)
+
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                shard = json.load(f)
+            results = decode_probe_results(shard["results"])
+        except Exception as e:
+            log(f"Error loading shard results {path}: {e}")
+            continue
+        merge_probe_results(probe_state, results)
+        merge_group_rows(probe_state["groups"], shard.get("groups", {}))
+        probe_state["probed"] += len(results)
+        log(f"Merged {len(results)} endpoint results from {path}")
+
+    write_planned_results(candidates, probe_state, stats)
+    if outputs.changed:
+        update_readme(stats)
+    write_metrics(stats)
+
+def main(processes=PROBE_PROCESSES, force=False):
+    fetcher = Fetcher(force=force)
+    
+    metrics.reset()
+    outputs.reset()
+    with metrics.timer("history_load"):
+        history = load_history()
+        history = cleanup_history(history)
+        load_recent_history(history)
     
-    recent_cutoff_time = datetime.now() - timedelta(hours=RECENT_HOURS)
     stats = {}
     
     log("Starting Bridge Scraper Session...")
 
+    import asyncio
+    from probe_engine import load_static_hosts, run_targets
+    load_static_hosts()
+
+    with metrics.timer("pipeline"):
+        asyncio.run(run_targets(fetcher, history, stats, processes))
+
+    save_history(history)
+    history.close()
+    fetcher.save()
+    fetcher.close()
+    if outputs.changed:
+        log(f"{len(outputs.changed)} output files changed.")
+        report(stats)
+    else:
+        log("No output changes, skipping README.")
+
+    if should_upload():
+        package(stats)
+
+    write_metrics(stats)
+    log("Session Finished.")
+
+def should_upload():
+    return IS_GITHUB and (datetime.now().hour == 0 or TELEGRAM_UPLOAD)
+
+def read_output_stats():
+    stats = {}
     for target in TARGETS:
-        url = target["url"]
-        filename = target["file"]
-        bridge_path = os.path.join(BRIDGE_DIR, filename)
-        recent_filename = filename.replace(".txt", f"_{RECENT_HOURS}h.txt")
-        recent_path = os.path.join(BRIDGE_DIR, recent_filename)
-        tested_filename = filename.replace(".txt", "_tested.txt")
-        tested_path = os.path.join(BRIDGE_DIR, tested_filename)
-        transport_type = target["type"]
-        
-        existing_bridges = set()
-        if os.path.exists(bridge_path):
+        for name in output_filenames(target["file"]).values():
             try:
-                with open(bridge_path, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if is_valid_bridge_line(line):
-                            existing_bridges.add(line)
-            except:
-                pass
-
-        fetched_bridges = set()
-        try:
-            response = session.get(url, timeout=30)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                bridge_div = soup.find("div", id="bridgelines")
-                
-                if bridge_div:
-                    raw_text = bridge_div.get_text()
-                    lines = [line.strip() for line in raw_text.split("\n") if line.strip()]
-                    
-                    for line in lines:
-                        if is_valid_bridge_line(line):
-                            fetched_bridges.add(line)
-                            if line not in history:
-                                history[line] = datetime.now().isoformat()
-                else:
-                    log(f"Warning: No bridge container for {filename}.")
-            else:
-                log(f"Failed to fetch {url}. Status: {response.status_code}")
+                with open(os.path.join(BRIDGE_DIR, name), "rb") as f:
+                    stats[name] = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+            except OSError:
+                stats[name] = 0
+    return stats
 
-        except Exception as e:
-            log(f"Connection error for {filename}: {e}")
-
-        all_bridges = existing_bridges.union(fetched_bridges)
-        
-        if all_bridges:
-            with open(bridge_path, "w", encoding="utf-8") as f:
-                for bridge in sorted(all_bridges):
-                    f.write(bridge + "\n")
-            log(f"Processed {filename}: Total {len(all_bridges)}")
-        else:
-            with open(bridge_path, "w", encoding="utf-8") as f:
-                f.write("")
-
-        recent_bridges = []
-        for bridge in all_bridges:
-            if bridge in history:
-                try:
-                    first_seen = datetime.fromisoformat(history[bridge])
-                    if first_seen > recent_cutoff_time:
-                        recent_bridges.append(bridge)
-                except ValueError:
-                    pass
-        
-        if recent_bridges:
-            with open(recent_path, "w", encoding="utf-8") as f:
-                for bridge in sorted(recent_bridges):
-                    f.write(bridge + "\n")
-        else:
-            with open(recent_path, "w", encoding="utf-8") as f:
-                f.write("")
-        
-        tested_bridges = batch_test_bridges(list(all_bridges), transport_type)
-        
-        if tested_bridges:
-            with open(tested_path, "w", encoding="utf-8") as f:
-                for bridge in sorted(tested_bridges):
-                    f.write(bridge + "\n")
-            log(f"   → {len(tested_bridges)} bridges passed connectivity test for {filename}.")
-        else:
-            with open(tested_path, "w", encoding="utf-8") as f:
-                f.write("")
-            log(f"   → No bridges passed connectivity test for {filename}.")
-
-        stats[filename] = len(all_bridges)
-        stats[recent_filename] = len(recent_bridges)
-        stats[tested_filename] = len(tested_bridges)
+def report(stats=None):
+    stats = read_output_stats() if stats is None else stats
+    with metrics.timer("readme"):
+        update_readme(stats)
 
-    save_history(history)
-    update_readme(stats)
+def package(stats=None, upload=True):
+    stats = read_output_stats() if stats is None else stats
+    # Remove stray zip files; the current archive is kept so unchanged entries can be reused
+    for file in os.listdir(BRIDGE_DIR):
+        if file.endswith('.zip') and file != ZIP_NAME:
+            os.remove(os.path.join(BRIDGE_DIR, file))
+            log(f"Removed old zip file: {file}")
+
+    zip_path = os.path.join(BRIDGE_DIR, ZIP_NAME)
+    files = [(zip_arcname(file), os.path.join(BRIDGE_DIR, file)) for file in os.listdir(BRIDGE_DIR) if file.endswith('.txt')]
+    with metrics.timer("package"):
+        zip_digest = build_zip(zip_path, files)
     
-    current_hour = datetime.now().hour
-    should_upload = (current_hour == 0 and IS_GITHUB) or (IS_GITHUB and TELEGRAM_UPLOAD)
+    obfs4_total = stats.get('obfs4.txt', 0)
+    webtunnel_total = stats.get('webtunnel.txt', 0)
+    vanilla_total = stats.get('vanilla.txt', 0)
+    obfs4_tested = stats.get('obfs4_tested.txt', 0)
+    webtunnel_tested = stats.get('webtunnel_tested.txt', 0)
+    vanilla_tested = stats.get('vanilla_tested.txt', 0)
+    obfs4_recent = stats.get('obfs4_72h.txt', 0)
+    webtunnel_recent = stats.get('webtunnel_72h.txt', 0)
+    vanilla_recent = stats.get('vanilla_72h.txt', 0)
+    obfs4_ipv6 = stats.get('obfs4_ipv6.txt', 0)
+    webtunnel_ipv6 = stats.get('webtunnel_ipv6.txt', 0)
+    vanilla_ipv6 = stats.get('vanilla_ipv6.txt', 0)
+    obfs4_ipv6_recent = stats.get('obfs4_ipv6_72h.txt', 0)
+    webtunnel_ipv6_recent = stats.get('webtunnel_ipv6_72h.txt', 0)
+    vanilla_ipv6_recent = stats.get('vanilla_ipv6_72h.txt', 0)
     
-    if should_upload:
-        # Remove any existing zip files in the bridge directory to avoid clutter
-        for file in os.listdir(BRIDGE_DIR):
-            if file.endswith('.zip'):
-                os.remove(os.path.join(BRIDGE_DIR, file))
-                log(f"Removed old zip file: {file}")
-
-        zip_name = "tor_bridges.zip"
-        zip_path = os.path.join(BRIDGE_DIR, zip_name)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            archive_root = "Tor Bridges"
-            
-            for root, dirs, files in os.walk(BRIDGE_DIR):
-                for file in files:
-                    if file == zip_name or file == "bridge_history.json" or not file.endswith('.txt'):
-                        continue
-                    
-                    file_path = os.path.join(root, file)
-                    
-                    if file.endswith("_tested.txt"):
-                        folder = os.path.join(archive_root, "Tested")
-                    elif file.endswith(f"_{RECENT_HOURS}h.txt"):
-                        folder = os.path.join(archive_root, "Recent 72h")
-                    else:
-                        folder = os.path.join(archive_root, "Full Archive")
-                    
-                    arcname = os.path.join(folder, file)
-                    zipf.write(file_path, arcname)
-        
-        log(f"Created ZIP archive: {zip_path}")
-        
-        obfs4_total = stats.get('obfs4.txt', 0)
-        webtunnel_total = stats.get('webtunnel.txt', 0)
-        vanilla_total = stats.get('vanilla.txt', 0)
-        obfs4_tested = stats.get('obfs4_tested.txt', 0)
-        webtunnel_tested = stats.get('webtunnel_tested.txt', 0)
-        vanilla_tested = stats.get('vanilla_tested.txt', 0)
-        obfs4_recent = stats.get('obfs4_72h.txt', 0)
-        webtunnel_recent = stats.get('webtunnel_72h.txt', 0)
-        vanilla_recent = stats.get('vanilla_72h.txt', 0)
-        obfs4_ipv6 = stats.get('obfs4_ipv6.txt', 0)
-        webtunnel_ipv6 = stats.get('webtunnel_ipv6.txt', 0)
-        vanilla_ipv6 = stats.get('vanilla_ipv6.txt', 0)
-        obfs4_ipv6_recent = stats.get('obfs4_ipv6_72h.txt', 0)
-        webtunnel_ipv6_recent = stats.get('webtunnel_ipv6_72h.txt', 0)
-        vanilla_ipv6_recent = stats.get('vanilla_ipv6_72h.txt', 0)
-        
-        total_bridges = obfs4_total + webtunnel_total + vanilla_total + obfs4_ipv6 + webtunnel_ipv6 + vanilla_ipv6
-        
-        caption = f"""*Tor Bridges Collector - Live Update*
+    total_bridges = obfs4_total + webtunnel_total + vanilla_total + obfs4_ipv6 + webtunnel_ipv6 + vanilla_ipv6
+    
+    caption = f"""*Tor Bridges Collector - Live Update*
 
 *Source:* All bridges are fetched directly from the official Tor Project website (bridges.torproject.org) in real-time.
 
@@ -495,12 +1573,108 @@ def main():
 • Full Archive/ - Complete bridge history
 • Recent 72h/ - Bridges from last 3 days
 • Tested/ - Verified working bridges (IPv4 only)
+• Fastest/ - Tested bridges with the lowest latency
 
 Note: IPv6 bridges are fewer and less stable than IPv4. For best results, use IPv4 bridges first."""
-        
-        send_to_telegram(zip_path, caption)
     
-    log("Session Finished.")
+    if not upload:
+        return
+    if load_upload_state().get("digest") == zip_digest:
+        log("ZIP unchanged since last upload, skipping Telegram upload.")
+    else:
+        with metrics.timer("upload"):
+            if send_to_telegram(zip_path, caption):
+                save_upload_state(zip_digest)
+
+def fetch(force=False):
+    import asyncio
+    from probe_engine import run_fetch_cycle
+    metrics.reset()
+    outputs.reset()
+    fetcher = Fetcher(force=force)
+    with metrics.timer("history_load"):
+        history = cleanup_history(load_history())
+        load_recent_history(history)
+    archives = {target["file"]: read_archive(target["file"]) for target in TARGETS}
+    stats = {}
+    log("Fetching new bridges...")
+    with metrics.timer("pipeline"):
+        asyncio.run(run_fetch_cycle(fetcher, history, archives, stats))
+    save_history(history)
+    history.close()
+    fetcher.save()
+    fetcher.close()
+    log(f"{len(outputs.changed)} output files changed.")
+    write_metrics(stats)
+
+def probe(processes=PROBE_PROCESSES):
+    import asyncio
+    from probe_engine import load_static_hosts, probe_archives
+    metrics.reset()
+    outputs.reset()
+    with metrics.timer("history_load"):
+        history = load_history()
+        load_recent_history(history)
+        history.close()
+    load_static_hosts()
+    archives = {target["file"]: read_archive(target["file"]) for target in TARGETS}
+    stats = {}
+    log("Probing archived bridges...")
+    with metrics.timer("pipeline"):
+        asyncio.run(probe_archives(archives, stats, processes))
+    log(f"{len(outputs.changed)} output files changed.")
+    write_metrics(stats)
+
+def serve(host=SERVE_HOST, port=SERVE_PORT):
+    import bridge_service
+    bridge_service.serve(host, port)
+
+def daemon(fetch_interval, probe_interval):
+    import asyncio
+    from probe_engine import load_static_hosts, run_daemon
+    metrics.reset()
+    load_static_hosts()
+    asyncio.run(run_daemon(fetch_interval, probe_interval))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Collect, test and archive Tor bridges.")
+    parser.set_defaults(processes=PROBE_PROCESSES, force=False)
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    all_command = commands.add_parser("all", help="fetch, probe, report and package in one run (default)")
+    all_command.add_argument("--processes", type=int, default=PROBE_PROCESSES, help="fan probing out across this many worker processes")
+    all_command.add_argument("--force", action="store_true", help="fetch every target even if its adaptive interval has not elapsed")
+    fetch_command = commands.add_parser("fetch", help="fetch new bridges into the archives and 72h lists")
+    fetch_command.add_argument("--force", action="store_true", help="fetch every target even if its adaptive interval has not elapsed")
+    probe_command = commands.add_parser("probe", help="test the archived bridges and write the tested and fastest lists")
+    probe_command.add_argument("--processes", type=int, default=PROBE_PROCESSES, help="fan probing out across this many worker processes")
+    shard_options = probe_command.add_mutually_exclusive_group()
+    shard_options.add_argument("--shard", type=parse_shard, metavar="I/N", help="probe only partition I of N and write its results file")
+    shard_options.add_argument("--merge", nargs="+", metavar="FILE", help="merge shard result files into the tested lists")
+    probe_command.add_argument("--shard-output", metavar="FILE", help="where to write the shard results (default bridge/shards/shard-I-of-N.json)")
+    commands.add_parser("report", help="regenerate README.md from the bridge lists on disk")
+    commands.add_parser("package", help="build the bridge ZIP and upload it to Telegram when enabled")
+    daemon_command = commands.add_parser("daemon", help="keep running with an internal scheduler and warm caches")
+    daemon_command.add_argument("--fetch-interval", type=int, default=DAEMON_FETCH_INTERVAL, help="seconds between fetches")
+    daemon_command.add_argument("--probe-interval", type=int, default=DAEMON_PROBE_INTERVAL, help="seconds between probe slices")
+    serve_command = commands.add_parser("serve", help="serve read-only bridge queries over HTTP")
+    serve_command.add_argument("--host", default=SERVE_HOST, help="address to serve on")
+    serve_command.add_argument("--port", type=int, default=SERVE_PORT, help="port to serve on")
+    args = parser.parse_args()
+    if args.command == "fetch":
+        run_profiled(lambda: fetch(args.force))
+    elif args.command == "probe" and args.shard:
+        run_profiled(lambda: run_shard(*args.shard, args.shard_output))
+    elif args.command == "probe" and args.merge:
+        run_profiled(lambda: merge_shards(args.merge))
+    elif args.command == "probe":
+        run_profiled(lambda: probe(args.processes))
+    elif args.command == "report":
+        run_profiled(report)
+    elif args.command == "package":
+        run_profiled(lambda: package(upload=should_upload()))
+    elif args.command == "daemon":
+        run_profiled(lambda: daemon(args.fetch_interval, args.probe_interval))
+    elif args.command == "serve":
+        serve(args.host, args.port)
+    else:
+        run_profiled(lambda: main(args.processes, args.force))
@@ -0,0 +1,520 @@
+import asyncio
+import ipaddress
+import json
+import os
+import signal
+import socket
+import ssl
+import time
+
+from main import (
+    MAX_TEST_PER_TYPE, PROBE_CACHE_TTL, PROBE_COVERAGE_HOURS, TARGETS, Fetcher, ProbeTiming, bridge_table,
+    cached_timings, cleanup_history, collect_endpoints, finish_probe_round, is_ip_literal, load_history,
+    load_recent_history, log, log_target_errors, merge_group_rows, merge_probe_results, metrics, new_probe_state,
+    outputs, parse_bridge_lines, plan_probe_endpoints, probe_endpoint_key, read_archive, save_history,
+    save_probe_cache, save_probe_stats, select_candidates, shard_of, smart_bridge_filter, summarize_groups,
+    update_archive, update_probe_stats, update_readme, write_metrics, write_planned_results, write_tested,
+)
+
+MAX_CONCURRENT_PROBES = 500
+CONNECTION_TIMEOUT = 8
+MAX_RETRIES = 2
+SSL_TIMEOUT = 5
+PROBE_MODE = os.getenv('PROBE_MODE', 'fast')
+PROBE_DEADLINE = CONNECTION_TIMEOUT * MAX_RETRIES + 2
+DNS_TIMEOUT = 5
+DNS_CACHE_TTL = 600
+DNS_NEGATIVE_TTL = 120
+PROBE_GROUP_CANARIES = 2
+DNS_STATIC_HOSTS = os.getenv('DNS_STATIC_HOSTS')
+
+def classify_probe_error(error):
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    if isinstance(error, ConnectionRefusedError):
+        return "refused"
+    if isinstance(error, (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)):
+        return "reset"
+    if isinstance(error, ssl.SSLError):
+        return "tls"
+    if isinstance(error, socket.gaierror):
+        return "dns"
+    if isinstance(error, OSError):
+        return "network"
+    return "other"
+
+_loop_state = {}
+
+def get_loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        _loop_state.clear()
+        state = _loop_state[loop] = {"semaphore": asyncio.Semaphore(MAX_CONCURRENT_PROBES), "dns": {}}
+    return state
+
+_dns_cache = {}
+_dns_static_hosts = None
+
+def set_static_resolver(table):
+    global _dns_static_hosts
+    _dns_static_hosts = table
+    _dns_cache.clear()
+
+async def lookup_host(host):
+    metrics.incr("dns_lookups")
+    start = time.perf_counter()
+    addresses = {"IPv4": [], "IPv6": []}
+    if _dns_static_hosts is not None:
+        for address in _dns_static_hosts.get(host, []):
+            addresses["IPv6" if ":" in address else "IPv4"].append(address)
+    else:
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM),
+                DNS_TIMEOUT,
+            )
+        except Exception:
+            infos = []
+        for family, _, _, _, sockaddr in infos:
+            name = "IPv6" if family == socket.AF_INET6 else "IPv4"
+            if sockaddr[0] not in addresses[name]:
+                addresses[name].append(sockaddr[0])
+    metrics.observe("dns_seconds", time.perf_counter() - start)
+    ttl = DNS_CACHE_TTL if addresses["IPv4"] or addresses["IPv6"] else DNS_NEGATIVE_TTL
+    if ttl == DNS_NEGATIVE_TTL:
+        metrics.incr("dns_failures")
+    _dns_cache[host] = (time.monotonic() + ttl, addresses)
+    return addresses
+
+async def resolve_host(host):
+    entry = _dns_cache.get(host)
+    if entry and entry[0] > time.monotonic():
+        metrics.incr("dns_cache_hits")
+        return entry[1]
+    inflight = get_loop_state()["dns"]
+    task = inflight.get(host)
+    if task is None:
+        task = inflight[host] = asyncio.ensure_future(lookup_host(host))
+        task.add_done_callback(lambda _: inflight.pop(host, None))
+    return await asyncio.shield(task)
+
+class ProbeProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.reply = asyncio.get_running_loop().create_future()
+
+    def data_received(self, data):
+        if not self.reply.done():
+            self.reply.set_result(data)
+
+    def connection_lost(self, exc):
+        if not self.reply.done():
+            self.reply.set_result(b"")
+
+async def wait_for_reply(transport, protocol, payload, timeout):
+    try:
+        transport.write(payload)
+        await asyncio.wait_for(protocol.reply, timeout)
+    except Exception:
+        pass
+
+async def open_probe_connection(host, port, timeout):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    transport, protocol = await asyncio.wait_for(loop.create_connection(ProbeProtocol, host, port), timeout)
+    return transport, protocol, (loop.time() - start) * 1000
+
+def note_probe_error(kind, errors=None):
+    metrics.incr(f"probe_errors_{kind}")
+    if errors is not None:
+        errors.append(kind)
+
+async def test_tcp_socket(host, port, timeout, errors=None):
+    try:
+        transport, protocol, connect_ms = await open_probe_connection(host, port, timeout)
+    except Exception as e:
+        note_probe_error(classify_probe_error(e), errors)
+        return None
+    if PROBE_MODE == "full":
+        await wait_for_reply(transport, protocol, b"\x00", 1)
+    transport.close()
+    return ProbeTiming(round(connect_ms, 1), None)
+
+def create_probe_ssl_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
+
+async def test_ssl_socket(host, port, timeout, server_hostname=None, errors=None):
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol, connect_ms = await open_probe_connection(host, port, timeout)
+    except Exception as e:
+        note_probe_error(classify_probe_error(e), errors)
+        return None
+    start = loop.time()
+    try:
+        tls_transport = await loop.start_tls(
+            transport, protocol, create_probe_ssl_context(),
+            server_hostname=server_hostname or host, ssl_handshake_timeout=timeout,
+        )
+    except Exception as e:
+        note_probe_error('tls_timeout' if classify_probe_error(e) == 'timeout' else 'tls', errors)
+        transport.close()
+        return None
+    handshake_ms = (loop.time() - start) * 1000
+    if PROBE_MODE == "full":
+        await wait_for_reply(tls_transport, protocol, b"GET / HTTP/1.0\r\n\r\n", SSL_TIMEOUT)
+    tls_transport.close()
+    return ProbeTiming(round(connect_ms, 1), round(handshake_ms, 1))
+
+async def advanced_connection_test(bridge, family="IPv4", errors=None):
+    host, port = bridge.host, bridge.port
+    timeout = CONNECTION_TIMEOUT
+    if bridge.family != "domain":
+        test_hosts = [host]
+    else:
+        addresses = await resolve_host(host)
+        test_hosts = addresses[family][:2]
+        if not test_hosts:
+            note_probe_error("dns", errors)
+    for test_host in test_hosts:
+        for attempt in range(MAX_RETRIES):
+            try:
+                if bridge.transport == "webtunnel":
+                    timing = await test_ssl_socket(test_host, port, timeout, server_hostname=host, errors=errors)
+                else:
+                    timing = await test_tcp_socket(test_host, port, timeout, errors)
+                if timing:
+                    return timing
+            except Exception:
+                pass
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(0.3 * (attempt + 1))
+    return None
+
+async def probe_bridge(bridge, family="IPv4", errors=None):
+    async with get_loop_state()["semaphore"]:
+        start = time.perf_counter()
+        try:
+            timing = await asyncio.wait_for(advanced_connection_test(bridge, family, errors), PROBE_DEADLINE)
+        except Exception:
+            note_probe_error("deadline", errors)
+            timing = None
+        end = time.perf_counter()
+        metrics.incr("probes_total")
+        metrics.incr("probes_working" if timing else "probes_failed")
+        metrics.observe("probe_seconds", end - start)
+        metrics.mark_window("probe", start, end)
+        metrics.record_slow(f"{bridge.transport} {bridge.host}:{bridge.port} {family}", end - start)
+        return timing
+
+def probe_group(endpoint):
+    host, family = endpoint[1], endpoint[3]
+    if family == "IPv4" and is_ip_literal(host, socket.AF_INET):
+        return str(ipaddress.ip_network(f"{host}/24", strict=False))
+    if family == "IPv6" and is_ip_literal(host, socket.AF_INET6):
+        return str(ipaddress.ip_network(f"{host}/48", strict=False))
+    return f"{host} ({family})"
+
+def new_probe_group():
+    return {"ready": asyncio.get_running_loop().create_future(), "reachable": None, "canaries": 0, "finished": 0, "timeouts": 0, "working": 0, "failed": 0, "skipped": 0}
+
+def settle_probe_group(group, timing, errors):
+    timed_out = bool(not timing and errors and all(kind in ("timeout", "deadline") for kind in errors))
+    group["finished"] += 1
+    group["timeouts"] += timed_out
+    if group["ready"].done():
+        return
+    if timing or not timed_out:
+        group["reachable"] = True
+    elif group["finished"] == group["canaries"] == PROBE_GROUP_CANARIES:
+        group["reachable"] = group["timeouts"] < PROBE_GROUP_CANARIES
+    else:
+        return
+    group["ready"].set_result(group["reachable"])
+
+async def probe_with_group(endpoint, bridge, groups):
+    key = probe_group(endpoint)
+    group = groups.get(key)
+    if group is None:
+        group = groups[key] = new_probe_group()
+    canary = group["canaries"] < PROBE_GROUP_CANARIES and not group["ready"].done()
+    if canary:
+        group["canaries"] += 1
+    elif not await group["ready"]:
+        group["skipped"] += 1
+        metrics.incr("probes_skipped_group")
+        return None, True
+    errors = []
+    timing = None
+    try:
+        timing = await probe_bridge(bridge, endpoint[3], errors)
+    finally:
+        if canary:
+            settle_probe_group(group, timing, errors)
+    group["working" if timing else "failed"] += 1
+    return timing, False
+
+async def async_probe_endpoints(endpoints, batch_size=100, groups=None):
+    results = {}
+    total = len(endpoints)
+    pending = {}
+    queue = iter(endpoints.items())
+    finished = 0
+    working_count = 0
+    while True:
+        while len(pending) < MAX_CONCURRENT_PROBES:
+            item = next(queue, None)
+            if item is None:
+                break
+            endpoint, bridge = item
+            if groups is None:
+                probe = probe_bridge(bridge, endpoint[3])
+            else:
+                probe = probe_with_group(endpoint, bridge, groups)
+            pending[asyncio.ensure_future(probe)] = endpoint
+        if not pending:
+            break
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            endpoint = pending.pop(future)
+            finished += 1
+            try:
+                timing = future.result()
+                if groups is not None:
+                    timing, skipped = timing
+                    if skipped:
+                        continue
+            except:
+                timing = None
+            results[endpoint] = timing
+            working_count += bool(timing)
+            if finished % batch_size == 0 or finished == total:
+                log(f"   Probed {finished}/{total}: {working_count} endpoints reachable")
+    return results
+
+async def async_batch_test_bridges(bridge_list, transport_type, batch_size=100):
+    if not bridge_list:
+        return []
+    filtered_bridges = smart_bridge_filter(bridge_list, transport_type)
+    if not filtered_bridges:
+        return []
+    results = await async_probe_endpoints(collect_endpoints([filtered_bridges]), batch_size)
+    return [bridge for bridge in filtered_bridges if results.get(probe_endpoint_key(bridge))]
+
+def batch_test_bridges(bridge_list, transport_type, batch_size=100):
+    return asyncio.run(async_batch_test_bridges(bridge_list, transport_type, batch_size))
+
+async def probe_and_cache(endpoint, bridge, probe_state):
+    timing, skipped = await probe_with_group(endpoint, bridge, probe_state["groups"])
+    if skipped:
+        return None
+    now = int(time.time())
+    probe_state["cache"][endpoint] = (now, timing)
+    update_probe_stats(probe_state["stats"], endpoint, bool(timing), now)
+    return timing
+
+def schedule_probes(bridges, probe_state, ip="IPv4"):
+    cache = probe_state["cache"]
+    inflight = probe_state["inflight"]
+    futures = []
+    for bridge in bridges:
+        endpoint = probe_endpoint_key(bridge, ip)
+        future = inflight.get(endpoint)
+        if future is None:
+            if endpoint in cache and cache[endpoint][0] > time.time() - PROBE_CACHE_TTL:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(cache[endpoint][1])
+                probe_state["cached"] += 1
+            else:
+                future = asyncio.ensure_future(probe_and_cache(endpoint, bridge, probe_state))
+                probe_state["probed"] += 1
+            inflight[endpoint] = future
+        futures.append(future)
+    probe_state["candidates"] += len(futures)
+    return futures
+
+def probe_shard_worker(endpoints, concurrency=MAX_CONCURRENT_PROBES):
+    global MAX_CONCURRENT_PROBES
+    MAX_CONCURRENT_PROBES = concurrency
+    metrics.reset()
+    load_static_hosts()
+    groups = {}
+    timings = asyncio.run(async_probe_endpoints(endpoints, groups=groups))
+    now = int(time.time())
+    return {endpoint: (now, timing) for endpoint, timing in timings.items()}, metrics.counters, metrics.windows.get("probe"), summarize_groups(groups)
+
+def load_static_hosts():
+    if DNS_STATIC_HOSTS:
+        with open(DNS_STATIC_HOSTS, "r", encoding="utf-8") as f:
+            set_static_resolver(json.load(f))
+
+async def fetch_target(target, fetcher, history, archive):
+    filename = target["file"]
+    if not fetcher.due(target):
+        metrics.incr("fetch_skipped")
+        log(f"Skipping {filename}: next fetch in {int(fetcher.next_fetch(target) - time.time()) // 60} min (yield {fetcher.entry(target).get('yield', 0):.1f} new per fetch).")
+        return
+    try:
+        lines = await asyncio.get_running_loop().run_in_executor(None, fetcher.fetch, target)
+    except Exception as e:
+        log(f"Connection error for {filename}: {e}")
+        fetcher.record(target, None)
+        return
+    if lines is None:
+        log(f"{filename} not modified since the last fetch.")
+        fetcher.record(target, 0)
+        return
+    with metrics.timer("parse"):
+        fetched_bridges = parse_bridge_lines(lines)
+    metrics.incr("bridges_fetched", len(fetched_bridges))
+    fetched_lines = [bridge.line for bridge in fetched_bridges]
+    history.record_seen(fetched_lines, int(time.time()))
+    fetched_ids = [bridge_table.add_bridge(bridge) for bridge in fetched_bridges]
+    bridge_table.load_first_seen(history.first_seen_for(fetched_lines))
+    known = len(archive)
+    archive.update(fetched_ids)
+    fetcher.record(target, len(archive) - known)
+    log(f"Fetched {filename}: {len(archive) - known} new of {len(fetched_bridges)} (yield {fetcher.entry(target)['yield']:.1f} new per fetch).")
+
+async def probe_target(target, all_bridges, probe_state, limit=None):
+    filename = target["file"]
+    candidates = select_candidates(all_bridges, probe_state["stats"], target["ip"], limit)
+    if len(candidates) < len(all_bridges):
+        log(f"   {filename}: probing {len(candidates)} of {len(all_bridges)} bridges by priority")
+    results = await asyncio.gather(*schedule_probes(candidates, probe_state, target["ip"]))
+    return {bridge: timing for bridge, timing in zip(candidates, results) if timing}
+
+async def process_target(target, fetcher, history, stats, probe_state):
+    all_bridges = read_archive(target["file"])
+    await fetch_target(target, fetcher, history, all_bridges)
+    update_archive(target, all_bridges, stats)
+    timings = await probe_target(target, all_bridges, probe_state)
+    write_tested(target, timings, probe_state, stats)
+
+async def run_targets(fetcher, history, stats, processes=1):
+    if processes > 1:
+        return await run_targets_pooled(fetcher, history, stats, processes)
+    probe_state = new_probe_state()
+    results = await asyncio.gather(
+        *(process_target(target, fetcher, history, stats, probe_state) for target in TARGETS),
+        return_exceptions=True,
+    )
+    log_target_errors(results)
+    finish_probe_round(probe_state, stats)
+
+async def run_targets_pooled(fetcher, history, stats, processes):
+    probe_state = new_probe_state()
+    archives = {}
+
+    async def fetch_one(target):
+        filename = target["file"]
+        archives[filename] = read_archive(filename)
+        await fetch_target(target, fetcher, history, archives[filename])
+        update_archive(target, archives[filename], stats)
+
+    log_target_errors(await asyncio.gather(*(fetch_one(target) for target in TARGETS), return_exceptions=True))
+    await probe_pooled(archives, probe_state, stats, processes)
+
+async def probe_pooled(archives, probe_state, stats, processes):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    candidates, endpoints = plan_probe_endpoints(archives, probe_state)
+
+    parts = [{} for _ in range(processes)]
+    for endpoint, bridge in endpoints.items():
+        parts[shard_of(endpoint, processes)][endpoint] = bridge
+    log(f"Probing {len(endpoints)} endpoints across {processes} processes")
+    loop = asyncio.get_running_loop()
+    concurrency = max(1, MAX_CONCURRENT_PROBES // processes)
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        shard_results = await asyncio.gather(*(loop.run_in_executor(executor, probe_shard_worker, part, concurrency) for part in parts if part))
+    for results, counters, window, groups in shard_results:
+        merge_probe_results(probe_state, results)
+        metrics.merge(counters, window)
+        merge_group_rows(probe_state["groups"], groups)
+    write_planned_results(candidates, probe_state, stats)
+
+async def run_fetch_cycle(fetcher, history, archives, stats):
+    async def fetch_one(target):
+        await fetch_target(target, fetcher, history, archives[target["file"]])
+        update_archive(target, archives[target["file"]], stats)
+
+    log_target_errors(await asyncio.gather(*(fetch_one(target) for target in TARGETS), return_exceptions=True))
+
+async def run_probe_cycle(archives, probe_state, stats, slice_size):
+    async def probe_one(target):
+        filename = target["file"]
+        await probe_target(target, archives[filename], probe_state, slice_size)
+        timings = cached_timings(target, archives[filename], probe_state, PROBE_COVERAGE_HOURS * 3600)
+        write_tested(target, timings, probe_state, stats)
+
+    log_target_errors(await asyncio.gather(*(probe_one(target) for target in TARGETS), return_exceptions=True))
+    finish_probe_round(probe_state, stats)
+
+async def probe_archives(archives, stats, processes=1):
+    probe_state = new_probe_state()
+    if processes > 1:
+        return await probe_pooled(archives, probe_state, stats, processes)
+
+    async def probe_one(target):
+        timings = await probe_target(target, archives[target["file"]], probe_state)
+        write_tested(target, timings, probe_state, stats)
+
+    log_target_errors(await asyncio.gather(*(probe_one(target) for target in TARGETS), return_exceptions=True))
+    finish_probe_round(probe_state, stats)
+
+async def run_daemon(fetch_interval, probe_interval):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    fetcher = Fetcher(fetch_interval, slack=0)
+    with metrics.timer("history_load"):
+        history = load_history()
+        load_recent_history(history)
+    probe_state = new_probe_state()
+    archives = {target["file"]: read_archive(target["file"]) for target in TARGETS}
+    stats = {}
+    slice_size = max(1, MAX_TEST_PER_TYPE * probe_interval // fetch_interval)
+    log(f"Daemon started: fetch each target every {fetch_interval}s on average, probe {slice_size} bridges per target every {probe_interval}s.")
+
+    next_fetch = next_probe = loop.time()
+    try:
+        while not stop.is_set():
+            outputs.reset()
+            if loop.time() >= next_fetch:
+                cleanup_history(history)
+                with metrics.timer("fetch_cycle"):
+                    await run_fetch_cycle(fetcher, history, archives, stats)
+                fetcher.save()
+                next_fetch = loop.time() + max(0, fetcher.next_due() - time.time())
+            if not stop.is_set() and loop.time() >= next_probe:
+                next_probe = loop.time() + probe_interval
+                with metrics.timer("probe_cycle"):
+                    await run_probe_cycle(archives, probe_state, stats, slice_size)
+            save_history(history)
+            if outputs.changed:
+                with metrics.timer("readme"):
+                    update_readme(stats)
+            write_metrics(stats)
+            try:
+                await asyncio.wait_for(stop.wait(), max(0, min(next_fetch, next_probe) - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        log("Daemon stopping, flushing state...")
+        save_probe_cache(probe_state["cache"])
+        save_probe_stats(probe_state["stats"])
+        save_history(history)
+        history.close()
+        fetcher.save()
+        fetcher.close()
+        log("Daemon stopped.")